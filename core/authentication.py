@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+class UserCache:
+    """
+    Bounded LRU of user rows with a time to live, shared by the threads of a
+    process. Saves and deletes evict entries of this process, the TTL bounds
+    how long other processes may serve a changed user.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            (expires_at, value) = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache(settings.AUTH_USER_CACHE["MAX_SIZE"], settings.AUTH_USER_CACHE["TTL"])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user, together with the id of its
+    customer, from user_cache instead of querying on every request. The
+    customer id is available as request.user.customer_id.
+
+    Only the flags authorization needs and the fields users/me shows are
+    cached, never the password, the other fields of request.user are loaded
+    when first read. Requests that may write get the current row, so a stale
+    cached user is never saved.
+    """
+    cached_fields = ["username", "email", "first_name", "last_name", "is_active", "is_staff", "is_superuser"]
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is None or request.method in SAFE_METHODS:
+            return result
+
+        # djoser's users/me saves request.user
+        (user, validated_token) = result
+        try:
+            user.refresh_from_db(fields=[field.attname for field in self.user_model._meta.concrete_fields])
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return (user, validated_token)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        # from_db takes the values in the order of the model fields
+        fields = [field.attname for field in self.user_model._meta.concrete_fields
+                  if field.primary_key or field.attname in self.cached_fields]
+        row = user_cache.get(str(user_id))
+        if row is None:
+            row = self.user_model.objects.filter(
+                **{api_settings.USER_ID_FIELD: user_id}).values_list(*fields, "customer__id").first()
+            if row is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(str(user_id), row)
+
+        # every request gets its own instance, the fields that are not cached
+        # are deferred
+        user = self.user_model.from_db(self.user_model.objects.db, fields, row[:-1])
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        user.customer_id = row[-1]
+        return user
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+from core.metrics import registry
+
+OPENED = registry.counter("db_connections_opened_total", "Database connections opened.")
+CLOSED = registry.counter("db_connections_closed_total", "Database connections closed.")
+HEALTH_CHECK_FAILURES = registry.counter(
+    "db_health_check_failures_total", "Reused database connections that failed their health check.")
+POOL_WAIT = registry.histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection.")
+POOL_TIMEOUTS = registry.counter("db_pool_timeouts_total", "Requests for a pooled connection that timed out.")
+POOL_CONNECTIONS = registry.gauge("db_pool_connections", "Pooled connections, idle or in use.")
+
+
+class ConnectionPool:
+    """
+    Raw DB-API connections shared by the threads of one process, at most
+    max_size of them open at once. Connections older than max_lifetime
+    seconds are closed when they come back. Released connections go to the
+    longest waiting thread first, so no thread starves under load.
+    """
+
+    def __init__(self, alias, max_size=10, timeout=10, max_lifetime=None):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.idle = deque()
+        self.waiters = deque()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, connect, check=None):
+        """
+        Returns an idle connection, which check() must accept, or one opened
+        with connect() while the pool is not full. Otherwise waits for one to
+        be released and raises OperationalError after timeout seconds.
+        """
+        while True:
+            (connection, opened_at) = self.take()
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self.discard(None)
+                    raise
+                OPENED.inc(alias=self.alias)
+                return (connection, opened_at)
+            if check is None or check(connection):
+                return (connection, opened_at)
+            HEALTH_CHECK_FAILURES.inc(alias=self.alias)
+            self.discard(connection)
+
+    def take(self):
+        # (None, opened_at) is a free slot to open a connection in
+        started = time.monotonic()
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if self.size < self.max_size:
+                self.size += 1
+                self.update_gauges()
+                return (None, time.monotonic())
+            waiter = [threading.Event(), None]
+            self.waiters.append(waiter)
+
+        waiter[0].wait(self.timeout)
+        with self.lock:
+            if waiter[1] is None:
+                self.waiters.remove(waiter)
+                POOL_TIMEOUTS.inc(alias=self.alias)
+                raise OperationalError(f"No connection to {self.alias} was released within {self.timeout}s.")
+        POOL_WAIT.observe(time.monotonic() - started, alias=self.alias)
+        return waiter[1]
+
+    def give(self, item):
+        # to the longest waiting thread, or back to the idle connections
+        if self.waiters:
+            waiter = self.waiters.popleft()
+            waiter[1] = item
+            waiter[0].set()
+        elif item[0] is not None:
+            self.idle.append(item)
+        else:
+            self.size -= 1
+        self.update_gauges()
+
+    def release(self, connection, opened_at):
+        if self.max_lifetime is not None and time.monotonic() - opened_at >= self.max_lifetime:
+            self.discard(connection)
+            return
+        try:
+            # nothing uncommitted may leak to the next user
+            connection.rollback()
+        except Exception:
+            self.discard(connection)
+            return
+        with self.lock:
+            self.give((connection, opened_at))
+
+    def discard(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            CLOSED.inc(alias=self.alias)
+        with self.lock:
+            # a waiting thread may open a connection in its place
+            self.give((None, time.monotonic()))
+
+    def update_gauges(self):
+        POOL_CONNECTIONS.set(len(self.idle), alias=self.alias, state="idle")
+        POOL_CONNECTIONS.set(self.size - len(self.idle), alias=self.alias, state="in_use")
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    options = settings_dict.get("POOL")
+    if not options:
+        return None
+    # the test runner points the alias to another database
+    key = (alias, str(settings_dict["NAME"]))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(alias, options.get("MAX_SIZE", 10), options.get("TIMEOUT", 10),
+                                        options.get("MAX_LIFETIME"))
+        return pools[key]
+
+
+def ping(connection):
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        finally:
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+class ManagedConnectionMixin:
+    """
+    Adds to a database backend, with these keys of its DATABASES entry:
+
+    CONN_HEALTH_CHECKS: checks that a persistent connection still works the
+    first time a request uses it, and reconnects if it does not. Django 4.1
+    has the same setting.
+
+    POOL: {"MAX_SIZE", "TIMEOUT", "MAX_LIFETIME"}, takes connections from a
+    per-process pool instead of opening them, and gives them back instead of
+    closing them. With CONN_MAX_AGE = 0 each request holds a connection only
+    while it runs, so threaded and ASGI servers need no more connections
+    than MAX_SIZE.
+
+    Connections opened and closed, and pool waits, go to core.metrics.
+    """
+    health_check_done = False
+    # the pool the current connection came from
+    connection_pool = None
+    opened_at = None
+
+    def can_pool(self):
+        return True
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict) if self.can_pool() else None
+        if pool is None:
+            connection = super().get_new_connection(conn_params)
+            OPENED.inc(alias=self.alias)
+            return connection
+
+        check = ping if self.settings_dict.get("CONN_HEALTH_CHECKS") else None
+        (connection, self.opened_at) = pool.acquire(
+            lambda: self.connect_to_database(conn_params), check)
+        self.connection_pool = pool
+        return connection
+
+    def connect_to_database(self, conn_params):
+        return super().get_new_connection(conn_params)
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        (pool, self.connection_pool) = (self.connection_pool, None)
+        if pool is None:
+            CLOSED.inc(alias=self.alias)
+            return super()._close()
+        if self.in_atomic_block or (self.errors_occurred and not self.is_usable()):
+            # the wrapper may still hold on to it, or it is broken
+            pool.discard(self.connection)
+        else:
+            pool.release(self.connection, self.opened_at)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # runs as requests start and finish
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done
+                and self.settings_dict.get("CONN_HEALTH_CHECKS") and not self.in_atomic_block):
+            self.health_check_done = True
+            if not self.is_usable():
+                HEALTH_CHECK_FAILURES.inc(alias=self.alias)
+                self.close()
+        super().ensure_connection()
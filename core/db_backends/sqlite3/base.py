@@ -0,0 +1,10 @@
+from django.db.backends.sqlite3 import base
+
+from core.db_backends.pooling import ManagedConnectionMixin
+
+
+class DatabaseWrapper(ManagedConnectionMixin, base.DatabaseWrapper):
+    def can_pool(self):
+        # connections to in-memory databases are never closed, so would
+        # never come back to the pool
+        return not self.is_in_memory_db()
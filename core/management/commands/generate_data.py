@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from core.synthetic import DEFAULT_UNTIL, DEFAULT_VOLUMES, Generator
+
+
+class Command(BaseCommand):
+    help = "Generates a deterministic synthetic dataset for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--days", type=int, default=365,
+                            help="Orders and reviews are spread over this many days")
+        parser.add_argument("--until", type=date.fromisoformat,
+                            help=f"Last day of orders and reviews, defaults to {DEFAULT_UNTIL}")
+        parser.add_argument("--scale", type=float, default=1,
+                            help="Multiplies every default volume")
+        for (name, count) in DEFAULT_VOLUMES.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, help=f"Defaults to {count}")
+
+    def handle(self, *args, **options):
+        volumes = {name: options[name] if options[name] is not None else round(count * options["scale"])
+                   for (name, count) in DEFAULT_VOLUMES.items()}
+        generator = Generator(seed=options["seed"], batch_size=options["batch_size"],
+                              days=options["days"], until=options["until"], log=self.stdout.write)
+        try:
+            generator.run(**volumes)
+        except ValidationError as error:
+            raise CommandError(" ".join(error.messages))
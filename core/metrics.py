@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def format_labels(labels, **extra):
+    labels = (*labels, *extra.items())
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for (name, value) in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        cumulative = 0
+        for (bound, count) in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{format_labels(labels, le=bound)} {cumulative}"
+        yield f"{name}_sum{format_labels(labels)} {self.sum}"
+        yield f"{name}_count{format_labels(labels)} {self.count}"
+
+
+class Metric:
+    """One metric family, its samples keyed by their sorted labels."""
+
+    def __init__(self, registry, name, help, kind, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.buckets = buckets
+        self.samples = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            if key not in self.samples:
+                self.samples[key] = Histogram(self.buckets)
+            self.samples[key].observe(value)
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.samples[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for (labels, sample) in sorted(self.samples.items()):
+            if self.kind == "histogram":
+                yield from sample.render(self.name, labels)
+            else:
+                yield f"{self.name}{format_labels(labels)} {sample}"
+
+
+class Registry:
+    """
+    In-process metrics. Every process (each gunicorn worker, say) keeps its
+    own, Prometheus adds them up across the scraped targets.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def metric(self, name, help, kind, buckets=None):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(self, name, help, kind, buckets)
+            return self.metrics[name]
+
+    def histogram(self, name, help, buckets=SECONDS_BUCKETS):
+        return self.metric(name, help, "histogram", buckets)
+
+    def counter(self, name, help):
+        return self.metric(name, help, "counter")
+
+    def gauge(self, name, help):
+        return self.metric(name, help, "gauge")
+
+    def render(self):
+        with self.lock:
+            return "\n".join(line for metric in self.metrics.values() for line in metric.render()) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.metrics.clear()
+
+
+registry = Registry()
+
+REQUESTS = registry.counter("http_requests_total", "Requests by route, method and status.")
+DURATION = registry.histogram("http_request_duration_seconds", "Time spent handling a request.")
+QUERIES = registry.histogram("http_request_queries", "SQL queries run by a request.", QUERIES_BUCKETS)
+DB_TIME = registry.histogram("http_request_db_seconds", "Time spent in SQL queries by a request.")
+SERIALIZER_TIME = registry.histogram(
+    "http_request_serializer_seconds",
+    "Time spent in DRF handlers outside SQL queries, mostly serialization.")
+RESPONSE_SIZE = registry.histogram("http_response_size_bytes", "Size of response bodies.", BYTES_BUCKETS)
+
+
+class RequestMetrics:
+    """Counts the queries of one request, installed with execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0
+        self.serializer_seconds = None
+        self.threads = set()
+
+    @contextmanager
+    def watch(self):
+        """
+        Counts the queries run on the connections of the current thread.
+        Under ASGI views run on other threads than the middleware, which
+        then watch for themselves.
+        """
+        thread = threading.get_ident()
+        if thread in self.threads:
+            yield
+            return
+        self.threads.add(thread)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                yield
+        finally:
+            self.threads.discard(thread)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+def get_settings():
+    return {"ENABLED": True, "LOG_REQUESTS": False, "TOKEN": None, **getattr(settings, "REQUEST_METRICS", {})}
+
+
+class MetricsMiddleware:
+    """
+    Records per route the duration, query count, database time and response
+    size of every request, and the serializer time measured by
+    InstrumentedViewMixin. Routes are URL names (products-list,
+    cart-items-detail, ...), unresolved paths share the "unmatched" route.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.settings = get_settings()
+        if asyncio.iscoroutinefunction(get_response):
+            # tells Django to await us, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.settings["ENABLED"]:
+            return self.get_response(request)
+
+        request.metrics = metrics = RequestMetrics()
+        started = time.perf_counter()
+        with metrics.watch():
+            response = self.get_response(request)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.settings["ENABLED"]:
+            return await self.get_response(request)
+
+        request.metrics = metrics = RequestMetrics()
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, metrics, duration):
+        match = getattr(request, "resolver_match", None)
+        route = (match.url_name or match.view_name) if match else "unmatched"
+        if route == "metrics":
+            return
+
+        labels = {"route": route, "method": request.method}
+        REQUESTS.inc(status=response.status_code, **labels)
+        DURATION.observe(duration, **labels)
+        QUERIES.observe(metrics.queries, **labels)
+        DB_TIME.observe(metrics.db_seconds, **labels)
+        if metrics.serializer_seconds is not None:
+            SERIALIZER_TIME.observe(metrics.serializer_seconds, **labels)
+        size = None if response.streaming else len(response.content)
+        if size is not None:
+            RESPONSE_SIZE.observe(size, **labels)
+
+        if self.settings["LOG_REQUESTS"]:
+            logger.info(json.dumps({
+                "route": route,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(duration * 1000, 2),
+                "queries": metrics.queries,
+                "db_ms": round(metrics.db_seconds * 1000, 2),
+                "serializer_ms": None if metrics.serializer_seconds is None
+                else round(metrics.serializer_seconds * 1000, 2),
+                "bytes": size,
+            }))
+
+
+class InstrumentedViewMixin:
+    """
+    Measures the time a DRF view spends in its handler, after
+    authentication and permission checks, less the time of its queries.
+    That is mostly serializers, the rest is filtering and pagination.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        metrics = getattr(request, "metrics", None)
+        if metrics is None:
+            return super().dispatch(request, *args, **kwargs)
+        with metrics.watch():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        metrics = getattr(request._request, "metrics", None)
+        if metrics is not None:
+            self._metrics_started = (time.perf_counter(), metrics.db_seconds)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        metrics = getattr(request._request, "metrics", None)
+        started = getattr(self, "_metrics_started", None)
+        if metrics is not None and started is not None:
+            (started_at, db_seconds) = started
+            metrics.serializer_seconds = max(
+                time.perf_counter() - started_at - (metrics.db_seconds - db_seconds), 0)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def can_read_metrics(request):
+    # Prometheus sends the token as bearer_token, people log in as staff
+    token = get_settings()["TOKEN"]
+    if token and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    user = getattr(request, "user", None)
+    return user is not None and user.is_active and user.is_staff
+
+
+def metrics_view(request):
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
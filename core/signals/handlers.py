@@ -1,7 +1,21 @@
-from store.signals import order_created
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+from core.authentication import user_cache
+from store.models import Customer
+from store.signals import order_created
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
     print(kwargs["order"])
 
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def evict_cached_user(sender, instance, **kwargs):
+    user_cache.delete(str(getattr(instance, api_settings.USER_ID_FIELD)))
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def evict_cached_customer_user(sender, instance, **kwargs):
+    user_cache.delete(str(instance.user_id))
@@ -0,0 +1,286 @@
+import time
+from datetime import date, datetime, time as clock, timedelta
+from decimal import Decimal
+from random import Random
+from uuid import UUID
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import DateTimeField, Max
+from django.utils import timezone
+
+from likes.models import LikedItem
+from store import summaries
+from store.cache import COLLECTION_PRODUCTS_VERSION, INVENTORY_VERSION, bump_versions
+from store.models import (Cart, CartItem, Collection, Customer, Order, OrderItem, Product,
+                          ProductImage, Promotion, Review)
+from store.provisioning import batches, bulk_create_users
+from store.search import invalidate_index
+from tags.models import Tag, TaggedItem
+
+DEFAULT_VOLUMES = {
+    "collections": 20,
+    "promotions": 50,
+    "products": 10000,
+    "customers": 5000,
+    "carts": 2000,
+    "orders": 50000,
+    "reviews": 20000,
+    "tags": 100,
+    "tagged_items": 20000,
+    "likes": 50000,
+}
+
+WORDS = ["basic", "classic", "deluxe", "eco", "fresh", "organic", "premium", "smart",
+         "compact", "wireless", "vintage", "family", "travel", "mini", "pro", "ultra"]
+NOUNS = ["coffee", "tea", "juice", "bread", "cheese", "pasta", "soap", "towel", "lamp",
+         "chair", "mug", "kettle", "speaker", "charger", "backpack", "notebook"]
+
+# orders and reviews end here unless told otherwise, so that a run does not
+# depend on the day it is made
+DEFAULT_UNTIL = date(2025, 12, 31)
+
+
+def next_id(model):
+    return (model.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+
+
+class Generator:
+    """
+    Builds a synthetic catalog and its activity with bulk_create, the same
+    seed, volumes and until always giving the same rows. Rows get explicit
+    ids, numbered from the first free id of each table, so foreign keys are
+    known without reading the inserts back, and sequences are reset at the
+    end. The new rows are added to whatever the database already holds and
+    only ever refer to each other.
+    """
+
+    def __init__(self, seed=0, batch_size=5000, days=365, until=None, log=None):
+        self.random = Random(seed)
+        self.seed = seed
+        self.batch_size = batch_size
+        self.days = days
+        self.until = until or DEFAULT_UNTIL
+        self.log = log or (lambda message: None)
+        self.prefix = f"synthetic{seed}_"
+
+    def run(self, **volumes):
+        volumes = {**DEFAULT_VOLUMES, **volumes}
+        negative = [name for (name, count) in volumes.items() if count < 0]
+        if negative:
+            raise ValidationError(f"Volumes may not be negative: {', '.join(negative)}.")
+        if volumes["products"] and not volumes["collections"]:
+            raise ValidationError("Products need at least one collection.")
+        started = time.perf_counter()
+        if get_user_model().objects.filter(username__startswith=self.prefix).exists():
+            raise ValidationError(f"Seed {self.seed} was already generated, pick another seed.")
+
+        with transaction.atomic():
+            self.step("promotions", self.promotions, volumes["promotions"])
+            self.step("collections", self.collections, volumes["collections"])
+            self.step("products", self.products, volumes["products"])
+            self.step("customers", self.customers, volumes["customers"])
+            self.step("carts", self.carts, volumes["carts"])
+            self.step("orders", self.orders, volumes["orders"])
+            self.step("reviews", self.reviews, volumes["reviews"])
+            self.step("tags", self.tags, volumes["tags"], volumes["tagged_items"])
+            self.step("likes", self.likes, volumes["likes"])
+            self.reset_sequences()
+
+        bump_versions(Product, Collection, ProductImage, Promotion, COLLECTION_PRODUCTS_VERSION, INVENTORY_VERSION)
+        invalidate_index()
+        self.log(f"Done in {time.perf_counter() - started:.1f}s")
+
+    def step(self, name, method, *args):
+        started = time.perf_counter()
+        rows = method(*args)
+        seconds = time.perf_counter() - started
+        self.log(f"{name}: {rows} rows in {seconds:.1f}s ({round(rows / seconds) if seconds else rows} rows/s)")
+
+    def insert(self, model, objects):
+        rows = 0
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+            rows += len(batch)
+        return rows
+
+    def popular(self, count):
+        # skews picks towards the first items so some products are hot
+        return int(count * self.random.random() ** 2)
+
+    def distinct(self, count, picks):
+        chosen = set()
+        while len(chosen) < min(picks, count):
+            chosen.add(self.popular(count))
+        return sorted(chosen)
+
+    def spread_over_days(self, model, field, first_id, count):
+        # rows were inserted oldest first, so each day is one id range and
+        # one UPDATE, auto_now_add having stamped them all with today
+        first_day = self.until - timedelta(days=self.days - 1)
+        with_time = isinstance(model._meta.get_field(field), DateTimeField)
+        for day in range(self.days):
+            low = first_id + (day * count + self.days - 1) // self.days
+            high = first_id + ((day + 1) * count + self.days - 1) // self.days
+            if low < high:
+                value = first_day + timedelta(days=day)
+                if with_time:
+                    value = timezone.make_aware(datetime.combine(value, clock(12)))
+                model.objects.filter(pk__gte=low, pk__lt=high).update(**{field: value})
+
+    def promotions(self, count):
+        self.first_promotion = next_id(Promotion)
+        self.promotion_count = count
+        return self.insert(Promotion, (
+            Promotion(id=self.first_promotion + i, description=f"Promotion {i}",
+                      discount=self.random.choice([0.05, 0.1, 0.15, 0.2, 0.25, 0.5]))
+            for i in range(count)
+        ))
+
+    def collections(self, count):
+        self.first_collection = next_id(Collection)
+        self.collection_count = count
+        return self.insert(Collection, (
+            Collection(id=self.first_collection + i, title=f"{self.random.choice(WORDS).title()} {i}")
+            for i in range(count)
+        ))
+
+    def products(self, count):
+        self.first_product = next_id(Product)
+        self.product_count = count
+        self.prices = []
+
+        def products():
+            for i in range(count):
+                price = Decimal(self.random.randint(100, 99999)).scaleb(-2)
+                self.prices.append(price)
+                title = f"{self.random.choice(WORDS).title()} {self.random.choice(NOUNS)} {i}"
+                yield Product(
+                    id=self.first_product + i, title=title, slug=f"product-{self.seed}-{i}",
+                    description=f"{title} for load testing.", unit_price=price,
+                    inventory=self.random.randint(1, 1000),
+                    collection_id=self.first_collection + self.random.randrange(self.collection_count))
+
+        rows = self.insert(Product, products())
+
+        if self.promotion_count:
+            Through = Product.promotions.through
+            rows += self.insert(Through, (
+                Through(product_id=self.first_product + i,
+                        promotion_id=self.first_promotion + promotion)
+                for i in range(count) if self.random.random() < 0.2
+                for promotion in self.random.sample(range(self.promotion_count),
+                                                    min(2, self.promotion_count))
+            ))
+
+        if count:
+            collections = list(Collection.objects.filter(pk__gte=self.first_collection).order_by("id"))
+            for collection in collections:
+                collection.featured_product_id = self.first_product + self.popular(count)
+            Collection.objects.bulk_update(collections, ["featured_product"], batch_size=self.batch_size)
+        return rows
+
+    def customers(self, count):
+        prefix = self.prefix
+        bulk_create_users((
+            {"username": f"{prefix}{i}", "email": f"{prefix}{i}@example.com",
+             "first_name": self.random.choice(WORDS).title(), "last_name": f"Tester {i}",
+             "phone": f"555-{self.random.randint(0, 9999999):07d}",
+             "birth_date": date(1950, 1, 1) + timedelta(days=self.random.randrange(20000)),
+             "membership": self.random.choice("BBBSG")}
+            for i in range(count)
+        ), self.batch_size)
+        self.customer_ids = list(Customer.objects.filter(
+            user__username__startswith=prefix).order_by("id").values_list("id", flat=True))
+        self.user_ids = list(Customer.objects.filter(
+            user__username__startswith=prefix).order_by("id").values_list("user_id", flat=True))
+        return count * 2
+
+    def carts(self, count):
+        carts = [Cart(id=UUID(int=self.random.getrandbits(128), version=4)) for i in range(count)]
+        rows = self.insert(Cart, carts)
+        if self.product_count:
+            rows += self.insert(CartItem, (
+                CartItem(cart_id=cart.id, product_id=self.first_product + product,
+                         quantity=self.random.randint(1, 5))
+                for cart in carts
+                for product in self.distinct(self.product_count, self.random.randint(1, 5))
+            ))
+        return rows
+
+    def orders(self, count):
+        if not (self.customer_ids and self.product_count):
+            return 0
+        first_order = next_id(Order)
+        first_item = next_id(OrderItem)
+        rows = 0
+
+        for numbers in batches(range(count), self.batch_size):
+            orders, items = [], []
+            for i in numbers:
+                order = Order(id=first_order + i, customer_id=self.random.choice(self.customer_ids),
+                              payment_status=self.random.choice("CCCCPF"), total=0, items_count=0)
+                for product in self.distinct(self.product_count, self.random.randint(1, 5)):
+                    item = OrderItem(id=first_item + len(items) + rows, order_id=order.id,
+                                     product_id=self.first_product + product,
+                                     quantity=self.random.randint(1, 5), unit_price=self.prices[product])
+                    order.total += item.quantity * item.unit_price
+                    order.items_count += 1
+                    items.append(item)
+                orders.append(order)
+            Order.objects.bulk_create(orders)
+            OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+            rows += len(items)
+
+        self.spread_over_days(Order, "placed_at", first_order, count)
+        summaries.refresh_customers(Customer.objects.filter(
+            pk__in=Order.objects.filter(pk__gte=first_order).values("customer_id")))
+        return count + rows
+
+    def reviews(self, count):
+        if not self.product_count:
+            return 0
+        first_review = next_id(Review)
+        rows = self.insert(Review, (
+            Review(id=first_review + i, product_id=self.first_product + self.popular(self.product_count),
+                   name=f"Reviewer {self.random.randrange(100000)}",
+                   description=" ".join(self.random.choices(WORDS + NOUNS, k=12)))
+            for i in range(count)
+        ))
+        self.spread_over_days(Review, "date", first_review, count)
+        return rows
+
+    def tags(self, count, tagged_items):
+        first_tag = next_id(Tag)
+        rows = self.insert(Tag, (Tag(id=first_tag + i, label=f"{self.random.choice(WORDS)}-{i}")
+                                 for i in range(count)))
+        if count and self.product_count:
+            content_type = ContentType.objects.get_for_model(Product)
+            rows += self.insert(TaggedItem, (
+                TaggedItem(tag_id=first_tag + self.random.randrange(count), content_type=content_type,
+                           object_id=self.first_product + self.popular(self.product_count))
+                for i in range(tagged_items)
+            ))
+        return rows
+
+    def likes(self, count):
+        if not (self.user_ids and self.product_count):
+            return 0
+        content_type = ContentType.objects.get_for_model(Product)
+        return self.insert(LikedItem, (
+            LikedItem(user_id=self.random.choice(self.user_ids), content_type=content_type,
+                      object_id=self.first_product + self.popular(self.product_count))
+            for i in range(count)
+        ))
+
+    def reset_sequences(self):
+        # explicit ids leave PostgreSQL sequences behind, SQLite needs nothing
+        statements = connection.ops.sequence_reset_sql(no_style(), [
+            Promotion, Collection, Product, Product.promotions.through, Order, OrderItem,
+            Review, Tag, TaggedItem, LikedItem])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -1 +1,188 @@
+import sqlite3
+import threading
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.authentication import user_cache
+from core.db_backends.pooling import ConnectionPool
+from core.models import User
+from core.synthetic import DEFAULT_UNTIL, Generator
+from store.models import Collection, Order, Product
+
+
 # Create your tests here.
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.opened.append(connection)
+        return connection
+
+    def test_released_connections_are_reused(self):
+        pool = ConnectionPool("test", max_size=2)
+        (connection, opened_at) = pool.acquire(self.connect)
+        pool.release(connection, opened_at)
+
+        self.assertIs(pool.acquire(self.connect)[0], connection)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_acquire_times_out_when_the_pool_is_exhausted(self):
+        pool = ConnectionPool("test", max_size=1, timeout=0.05)
+        pool.acquire(self.connect)
+
+        with self.assertRaises(OperationalError):
+            pool.acquire(self.connect)
+
+    def test_waiting_threads_get_released_connections(self):
+        pool = ConnectionPool("test", max_size=1, timeout=5)
+        (connection, opened_at) = pool.acquire(self.connect)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire(self.connect)[0]))
+        waiter.start()
+
+        pool.release(connection, opened_at)
+        waiter.join()
+        self.assertEqual(acquired, [connection])
+        self.assertEqual(len(self.opened), 1)
+
+    def test_connections_failing_their_check_are_replaced(self):
+        pool = ConnectionPool("test", max_size=1)
+        (connection, opened_at) = pool.acquire(self.connect)
+        pool.release(connection, opened_at)
+
+        (replacement, opened_at) = pool.acquire(self.connect, check=lambda connection: False)
+        self.assertIsNot(replacement, connection)
+        self.assertEqual(pool.size, 1)
+
+    def test_connections_past_their_lifetime_are_closed(self):
+        pool = ConnectionPool("test", max_size=1, max_lifetime=0)
+        (connection, opened_at) = pool.acquire(self.connect)
+        pool.release(connection, opened_at)
+
+        self.assertEqual(pool.size, 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username="buyer", email="buyer@example.com", password="secret")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(self.user)}")
+        # cached by the first request
+        self.assertEqual(self.client.get("/auth/users/me/").status_code, 200)
+
+    def change_elsewhere(self, **fields):
+        # update() sends no signal, as a save in another process would not
+        # reach this process' cache
+        User.objects.filter(pk=self.user.pk).update(**fields)
+
+    def test_reads_are_served_from_the_cache(self):
+        # the cart only, not the user
+        with self.assertNumQueries(1):
+            self.client.get("/store/carts/00000000-0000-0000-0000-000000000000/")
+
+    def test_current_user_is_served_from_the_cache(self):
+        with self.assertNumQueries(0):
+            response = self.client.get("/auth/users/me/")
+
+        self.assertEqual(response.json(), {"id": self.user.pk, "username": "buyer", "email": "buyer@example.com",
+                                           "first_name": "", "last_name": ""})
+
+    def test_writes_do_not_save_stale_fields(self):
+        self.change_elsewhere(password=make_password("changed"), last_name="Elsewhere")
+
+        response = self.client.patch("/auth/users/me/", {"first_name": "Ada"})
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Ada")
+        self.assertEqual(self.user.last_name, "Elsewhere")
+        self.assertTrue(self.user.check_password("changed"))
+        # the save dropped the cached row
+        self.assertEqual(self.client.get("/auth/users/me/").json()["last_name"], "Elsewhere")
+
+    def test_writes_check_the_current_row(self):
+        self.change_elsewhere(is_active=False)
+
+        self.assertEqual(self.client.patch("/auth/users/me/", {"first_name": "Ada"}).status_code, 401)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "")
+
+
+class GenerateDataTests(TestCase):
+    volumes = {"collections": 3, "promotions": 2, "products": 20, "customers": 5, "carts": 2,
+               "orders": 30, "reviews": 10, "tags": 2, "tagged_items": 5, "likes": 5}
+
+    def generate(self):
+        """Generates seed 1 in a transaction that is rolled back, returns its rows by their own ids."""
+        with transaction.atomic():
+            Generator(seed=1).run(**self.volumes)
+            products = Product.objects.filter(slug__startswith="product-1-").order_by("id")
+            first_product = products[0].id
+            first_collection = Collection.objects.order_by("-id")[self.volumes["collections"] - 1].id
+            orders = Order.objects.filter(customer__user__username__startswith="synthetic1_").order_by("id")
+            first_order = orders[0].id
+            rows = {
+                "collections": [(collection.id - first_collection, collection.title,
+                                 collection.featured_product_id - first_product)
+                                for collection in Collection.objects.filter(pk__gte=first_collection)],
+                "products": [(product.id - first_product, product.title, product.unit_price, product.inventory,
+                              product.collection_id - first_collection) for product in products],
+                "orders": [(order.id - first_order, order.customer.user.username, order.placed_at, order.total,
+                            [(item.product_id - first_product, item.quantity) for item in order.orderitem_set.all()])
+                           for order in orders.prefetch_related("orderitem_set").select_related("customer__user")],
+            }
+            transaction.set_rollback(True)
+        return rows
+
+    def test_runs_do_not_depend_on_existing_rows_or_the_day(self):
+        rows = self.generate()
+        collection = Collection.objects.create(title="Existing")
+        Product.objects.create(title="Existing", slug="existing", unit_price=1, inventory=1, collection=collection)
+
+        with mock.patch("core.synthetic.date", wraps=date) as today:
+            today.today.return_value = date(2030, 1, 1)
+            self.assertEqual(self.generate(), rows)
+        days = {order[2] for order in rows["orders"]}
+        self.assertGreater(min(days), DEFAULT_UNTIL - timedelta(days=365))
+        self.assertLessEqual(max(days), DEFAULT_UNTIL)
+
+    def test_products_need_a_collection(self):
+        for args in [["--collections", "0", "--products", "10"], ["--scale", "0.02"]]:
+            with self.subTest(args=args):
+                with self.assertRaisesMessage(CommandError, "Products need at least one collection."):
+                    call_command("generate_data", *args, stdout=StringIO())
+                self.assertFalse(Product.objects.exists())
+
+
+class MetricsViewTests(TestCase):
+    def test_anonymous_requests_are_forbidden(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    def test_staff_may_read_metrics(self):
+        self.client.force_login(User.objects.create_user(username="staff", password="secret", is_staff=True))
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE http_requests_total counter", response.content.decode())
+
+    @override_settings(REQUEST_METRICS={"TOKEN": "secret"})
+    def test_scrapers_authenticate_with_the_token(self):
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer guess").status_code, 403)
@@ -40,7 +40,6 @@ INSTALLED_APPS = [
     "django_filters",
     'rest_framework',
     "djoser",
-    "debug_toolbar",
     "store",
     "tags",
     "likes",
@@ -48,7 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "core.metrics.MetricsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +57,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# the toolbar slows every request down, it is for development only
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.insert(0, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = 'e_commerce.urls'
 
 TEMPLATES = [
@@ -81,17 +85,49 @@ WSGI_APPLICATION = 'e_commerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# core.db_backends.postgresql (and .sqlite3) add CONN_HEALTH_CHECKS and an
+# optional per-process POOL, see core.db_backends.pooling. Set DB_POOL_SIZE
+# for threaded and ASGI servers, with DB_CONN_MAX_AGE=0 so every request
+# gives its connection back to the pool.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'core.db_backends.postgresql',
         'NAME': 'e_commerce',
         'USER': 'postgres',
         'PASSWORD': 'postgres',
         'HOST': 'localhost',
         'PORT': '5432',
+        'CONN_MAX_AGE': int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL': {
+            "MAX_SIZE": int(os.environ["DB_POOL_SIZE"]),
+            "TIMEOUT": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+            "MAX_LIFETIME": 3600,
+        } if os.environ.get("DB_POOL_SIZE") else None,
     },
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The local-memory cache is per process, use a shared backend such as
+# django.core.cache.backends.db.DatabaseCache or filebased.FileBasedCache
+# when running several workers.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+STORE_RESPONSE_CACHE_TIMEOUT = 300
+
+STORE_CUSTOMER_CACHE_TIMEOUT = 60
+
+# Dotted path of the product search backend, None picks PostgreSQL full-text
+# search on PostgreSQL and the in-process inverted index elsewhere.
+STORE_SEARCH_BACKEND = None
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -146,10 +182,35 @@ INTERNAL_IPS = [
 REST_FRAMEWORK = {
     "COERCE_DECIMAL_TO_STRING": False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Users resolved from JWTs are kept per process, see core.authentication
+AUTH_USER_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 60,
+}
+
+# Per-route query counts and timings, served on /metrics, see core.metrics
+REQUEST_METRICS = {
+    "ENABLED": True,
+    "LOG_REQUESTS": False,
+    # /metrics answers staff users and requests with "Authorization: Bearer <TOKEN>"
+    "TOKEN": os.environ.get("METRICS_TOKEN"),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "core.metrics": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
+
 AUTH_USER_MODEL = "core.User"
 
 SIMPLE_JWT = {
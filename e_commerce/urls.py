@@ -18,6 +18,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.metrics import metrics_view
 from . import views
 
 admin.site.site_header = "E-commerce administration"
@@ -26,12 +27,13 @@ admin.site.index_title = "administration"
 urlpatterns = [
     path("", views.say_hello),
     path('admin/', admin.site.urls),
-    path('__debug__/', include('debug_toolbar.urls')),
     path("store/", include("store.urls")),
     path("auth/", include('djoser.urls')),
     path("auth/", include('djoser.urls.jwt')),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 if settings.DEBUG:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
     urlpatterns += static(settings.MEDIA_URL,
                           document_root=settings.MEDIA_ROOT)
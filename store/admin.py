@@ -4,9 +4,11 @@ from django.contrib import admin, messages
 from django.db.models import Count, Sum
 from django.db.models.query import QuerySet
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 
-from . import models
+from . import models, summaries
+from .cache import INVENTORY_VERSION, bump_versions
 
 
 # Register your models here.
@@ -53,7 +55,10 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description="Clear inventory")
     def clear_inventory(self, request, queryset: QuerySet):
-        updated_count = queryset.update(inventory=1)
+        updated_count = queryset.update(inventory=1, last_update=timezone.now())
+        # update() sends no post_save and skips auto_now, so the cached
+        # product lists are invalidated here
+        bump_versions(INVENTORY_VERSION)
         self.message_user(
             request,
             f"{updated_count} products were successfully updated.",
@@ -83,7 +88,7 @@ class CollectionAdmin(admin.ModelAdmin):
 
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['first_name', 'last_name', "membership", "orders"]
+    list_display = ['first_name', 'last_name', "membership", "orders", "lifetime_spend", "last_order_at"]
     list_display_links = ['first_name']
     list_editable = ['membership']
     list_per_page = 10
@@ -100,6 +105,7 @@ class CustomerAdmin(admin.ModelAdmin):
         return customer.user.last_name
 
     # reverse("admin:app_model_page")
+    @admin.display(ordering="orders_count")
     def orders(self, customer):
         url = (reverse("admin:store_order_changelist")
                + "?"
@@ -108,11 +114,6 @@ class CustomerAdmin(admin.ModelAdmin):
                 }))
         return format_html("<a href='{}'>{}</a>", url, customer.orders_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            orders_count=Count("order")
-        )
-
 
 class InventoryFilter(admin.SimpleListFilter):
     title = "inventory"
@@ -141,11 +142,13 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
     autocomplete_fields = ["customer"]
     list_display = ["id", "customer",
-                    "placed_at", "payment_status", "products"]
+                    "placed_at", "payment_status", "products", "total"]
     list_display_links = ["id"]
     list_editable = ["payment_status"]
     list_per_page = 10
+    list_select_related = ["customer__user"]
 
+    @admin.display(ordering="items_count")
     def products(self, order):
         url = (reverse("admin:store_orderitem_changelist")
                + "?"
@@ -153,10 +156,22 @@ class OrderAdmin(admin.ModelAdmin):
                     "order__id": str(order.id)
                 }))
 
-        return format_html("<a href='{}'>{}</a>", url, order.products_count)
+        return format_html("<a href='{}'>{}</a>", url, order.items_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(products_count=Count("orderitem__product"))
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # the order may also have moved away from another customer
+        summaries.refresh_order(form.instance.id, form.initial.get("customer"))
+
+    def delete_model(self, request, order):
+        customer_id = order.customer_id
+        super().delete_model(request, order)
+        summaries.refresh_customers(models.Customer.objects.filter(pk=customer_id))
+
+    def delete_queryset(self, request, queryset):
+        customer_ids = list(queryset.values_list("customer_id", flat=True))
+        super().delete_queryset(request, queryset)
+        summaries.refresh_customers(models.Customer.objects.filter(pk__in=customer_ids))
 
 
 @admin.register(models.OrderItem)
@@ -165,6 +180,24 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display_links = ["product"]
     list_editable = ["quantity"]
     list_per_page = 10
+    list_select_related = ["product", "order"]
+
+    def save_model(self, request, order_item, form, change):
+        super().save_model(request, order_item, form, change)
+        previous_order_id = form.initial.get("order")
+        if previous_order_id not in [None, order_item.order_id]:
+            summaries.refresh_order(previous_order_id)
+        summaries.refresh_order(order_item.order_id)
+
+    def delete_model(self, request, order_item):
+        super().delete_model(request, order_item)
+        summaries.refresh_order(order_item.order_id)
+
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list("order_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for order_id in order_ids:
+            summaries.refresh_order(order_id)
 
 
 @admin.register(models.Promotion)
@@ -177,6 +210,7 @@ class PromotionAdmin(admin.ModelAdmin):
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ["product", "created_at", "quantity"]
     list_per_page = 10
+    list_select_related = ["cart", "product"]
 
     def created_at(self, cart_item: models.CartItem):
         return cart_item.cart.created_at
@@ -207,4 +241,12 @@ class CartAdmin(admin.ModelAdmin):
         return super().get_queryset(request).annotate(cartitem__quantity=Sum("cartitem__quantity"))
 
 
+@admin.register(models.OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ["id", "topic", "created_at", "attempts", "dispatched_at"]
+    list_filter = ["topic", "dispatched_at"]
+    list_per_page = 10
+    readonly_fields = ["created_at"]
+
+
 admin.site.register(models.Address)
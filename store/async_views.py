@@ -0,0 +1,138 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .cache import list_cache_key
+from .views import CollectionViewSet, ProductViewSet, ReviewViewSet
+
+# Read-only catalog endpoints for ASGI servers. Django 3.2 has no async ORM,
+# so each request runs its queries and serializers in one hop to a worker
+# thread, outside the thread every thread-sensitive call shares, while the
+# event loop keeps serving other clients. The filtering, pagination and
+# serialization are the viewsets' own, so are the responses, errors, the
+# cache of the lists and the ETag and Last-Modified of the products.
+
+
+def in_worker_thread(func):
+    """
+    Runs func on a thread pool with its own database connection, which is
+    closed or kept as CONN_MAX_AGE says, as a request would. Queries are
+    counted in the request's metrics, see core.metrics.
+    """
+    @sync_to_async(thread_sensitive=False)
+    @wraps(func)
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            metrics = getattr(request, "metrics", None)
+            if metrics is None:
+                return func(request, *args, **kwargs)
+            with metrics.watch():
+                return func(request, *args, **kwargs)
+        finally:
+            close_old_connections()
+    return run
+
+
+def render(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type="application/json")
+
+
+def render_response(response):
+    # the 304 of a conditional request has nothing to render
+    if not isinstance(response, Response):
+        return response
+    rendered = render(response.data, response.status_code)
+    for header in ["ETag", "Last-Modified"]:
+        if response.has_header(header):
+            rendered[header] = response[header]
+    return rendered
+
+
+def get_view(viewset, request, action, **kwargs):
+    # an instance as the router would dispatch to, without authentication:
+    # the catalog is public
+    return viewset(request=Request(request), args=(), kwargs=kwargs, format_kwarg=None, action=action)
+
+
+def list_data(view):
+    queryset = view.filter_queryset(view.get_queryset())
+    page = view.paginate_queryset(queryset)
+    if page is None:
+        return view.get_serializer(queryset, many=True).data
+    return view.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+
+def cached_list(view):
+    key = list_cache_key(view.request, view.cache_models)
+    data = cache.get(key)
+    if data is None:
+        data = list_data(view)
+        cache.set(key, data, settings.STORE_RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+def conditional(view, queryset, data):
+    # ConditionalGetMixin answers 304 before data is computed
+    if queryset is None:
+        return Response(data())
+    return view.conditional_response(view.request, queryset, lambda request: Response(data()))
+
+
+@in_worker_thread
+def product_page(request):
+    view = get_view(ProductViewSet, request, "list")
+    return conditional(view, view.get_conditional_queryset(), lambda: cached_list(view))
+
+
+@in_worker_thread
+def product_data(request, pk):
+    view = get_view(ProductViewSet, request, "retrieve", pk=pk)
+    return conditional(view, view.get_lookup_queryset(), lambda: view.get_serializer(view.get_object()).data)
+
+
+@in_worker_thread
+def collection_data(request):
+    return Response(cached_list(get_view(CollectionViewSet, request, "list")))
+
+
+@in_worker_thread
+def review_data(request, product_pk):
+    return Response(list_data(get_view(ReviewViewSet, request, "list", product_pk=product_pk)))
+
+
+async def respond(request, data, *args, **kwargs):
+    if request.method not in ["GET", "HEAD"]:
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    # the errors DRF's exception handler would answer
+    try:
+        return render_response(await data(request, *args, **kwargs))
+    except Http404:
+        return render({"detail": "Not found."}, status=404)
+    except APIException as error:
+        detail = error.detail if isinstance(error.detail, (list, dict)) else {"detail": error.detail}
+        return render(detail, status=error.status_code)
+
+
+async def product_list(request):
+    return await respond(request, product_page)
+
+
+async def product_detail(request, pk):
+    return await respond(request, product_data, pk)
+
+
+async def collection_list(request):
+    return await respond(request, collection_data)
+
+
+async def review_list(request, product_pk):
+    return await respond(request, review_data, product_pk)
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import math
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.metrics import RequestMetrics
+from core.models import User
+from .cache import INVENTORY_VERSION, bump_versions
+from .models import Cart, CartItem, Order, OrderItem, OutboxEvent, Product
+
+
+def add_arguments(parser, requests, warmup):
+    """The arguments every benchmark command takes."""
+    parser.add_argument("--requests", type=int, default=requests, help="Timed requests per run")
+    parser.add_argument("--warmup", type=int, default=warmup, help="Untimed requests before each run")
+    parser.add_argument("--label", help="Stored in the results, a commit or branch name say")
+    parser.add_argument("--output", help="Writes the results to this file instead of the standard output")
+
+
+def write_results(results, options, stdout):
+    results["meta"]["label"] = options["label"]
+    output = json.dumps(results, indent=2)
+    if options["output"]:
+        with open(options["output"], "w") as file:
+            file.write(output + "\n")
+    else:
+        stdout.write(output)
+
+
+def environment():
+    return {
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+    }
+
+
+class Scenario:
+    """
+    One request repeated by the benchmark. path and data may be callables,
+    called before each request and outside of its timing.
+    """
+
+    def __init__(self, name, method, path, data=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+
+    def request(self):
+        path = self.path() if callable(self.path) else self.path
+        data = self.data() if callable(self.data) else self.data
+        return (path, data)
+
+
+class Context:
+    """
+    The user, products and carts the scenarios work on. Scenarios commit
+    their writes as requests do, clean_up() removes them again.
+    """
+
+    def __init__(self, seed, products):
+        self.random = Random(seed)
+        self.started = timezone.now()
+        self.last_event = OutboxEvent.objects.aggregate(last=Max("id"))["last"] or 0
+        self.user = User.objects.create_user(username="benchmark", email="benchmark@example.com")
+        self.products = list(Product.objects.select_related("collection").order_by("id")[:products])
+        # checkouts may not run out of stock
+        Product.objects.filter(pk__in=[product.pk for product in self.products]).update(inventory=10 ** 9)
+        self.cart = Cart.objects.create()
+
+    def clean_up(self):
+        with transaction.atomic():
+            orders = Order.objects.filter(customer__user=self.user)
+            order_ids = list(orders.values_list("id", flat=True))
+            OutboxEvent.objects.filter(pk__gt=self.last_event, topic="order_created",
+                                       payload__order_id__in=order_ids).delete()
+            OrderItem.objects.filter(order_id__in=order_ids).delete()
+            orders.delete()
+            Cart.objects.filter(created_at__gte=self.started).delete()
+            self.user.delete()
+            Product.objects.bulk_update(self.products, ["inventory"])
+            bump_versions(INVENTORY_VERSION)
+
+    def product_id(self):
+        return self.random.choice(self.products).pk
+
+    def new_cart(self):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=self.random.randint(1, 3))
+            for product_id in {self.product_id() for i in range(3)}
+        ])
+        return cart.pk
+
+
+def default_scenarios(context):
+    product = context.products[0]
+    word = product.title.split()[0]
+    return [
+        Scenario("products-list", "GET", reverse("products-list")),
+        Scenario("products-list-filtered", "GET",
+                 f"{reverse('products-list')}?collection_id={product.collection_id}&unit_price__gt=1&unit_price__lt=500"),
+        Scenario("products-list-search", "GET", f"{reverse('products-list')}?search={word}"),
+        Scenario("products-list-ordered", "GET", f"{reverse('products-list')}?ordering=-unit_price"),
+        Scenario("collections-list", "GET", reverse("collections-list")),
+        Scenario("carts-create", "POST", reverse("carts-list")),
+        Scenario("cart-items-create", "POST", reverse("cart-items-list", kwargs={"cart_pk": context.cart.pk}),
+                 lambda: {"product_id": context.product_id(), "quantity": 1}),
+        Scenario("carts-detail", "GET", reverse("carts-detail", kwargs={"pk": context.cart.pk})),
+        Scenario("orders-create", "POST", reverse("orders-list"), lambda: {"cart_id": context.new_cart()}),
+        Scenario("orders-list", "GET", reverse("orders-list")),
+    ]
+
+
+def percentile(values, percent):
+    # nearest rank on sorted values
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def summarize(durations, seconds):
+    durations = sorted(durations)
+    return {
+        "requests": len(durations),
+        "p50_ms": round(percentile(durations, 50) * 1000, 3),
+        "p95_ms": round(percentile(durations, 95) * 1000, 3),
+        "p99_ms": round(percentile(durations, 99) * 1000, 3),
+        "mean_ms": round(sum(durations) / len(durations) * 1000, 3),
+        "throughput_rps": round(len(durations) / seconds, 1),
+    }
+
+
+def run_scenario(client, scenario, requests, warmup, cold=False):
+    durations = []
+    queries = 0
+    statuses = {}
+    for i in range(warmup + requests):
+        (path, data) = scenario.request()
+        if cold:
+            cache.clear()
+        counter = RequestMetrics()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            if scenario.method == "GET":
+                response = client.get(path)
+            else:
+                response = client.post(path, data, format="json")
+            duration = time.perf_counter() - started
+        if i < warmup:
+            continue
+        durations.append(duration)
+        queries += counter.queries
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    return {
+        **summarize(durations, sum(durations)),
+        "queries_per_request": round(queries / requests, 2),
+        "statuses": {str(status): count for (status, count) in sorted(statuses.items())},
+    }
+
+
+def run(requests=100, warmup=10, names=None, seed=0, products=100, cold=False):
+    """
+    Runs the scenarios through the whole middleware stack and URLconf with
+    the test client, authenticated by a JWT, and returns the results. Every
+    request commits, so COMMIT and the on_commit callbacks are measured, and
+    the rows the benchmark wrote are deleted at the end, carts by their
+    creation time: run it on a database of its own, filled by generate_data.
+
+    cold clears the cache before every request, so cached lists are
+    measured without their cache.
+    """
+    if not Product.objects.exists():
+        raise ValueError("There are no products to benchmark, run generate_data first.")
+    if User.objects.filter(username="benchmark").exists():
+        raise ValueError("A benchmark user exists, is another benchmark running?")
+
+    results = {}
+    # the debug toolbar and the query log would be measured too
+    with override_settings(DEBUG=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+        with transaction.atomic():
+            context = Context(seed, products)
+        try:
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(context.user)}")
+            for scenario in default_scenarios(context):
+                if names and scenario.name not in names:
+                    continue
+                results[scenario.name] = run_scenario(client, scenario, requests, warmup, cold)
+        finally:
+            context.clean_up()
+
+    return {
+        "meta": {
+            **environment(),
+            "transactions": "committed",
+            "requests": requests,
+            "warmup": warmup,
+            "cold": cold,
+            "seed": seed,
+            "products": Product.objects.count(),
+        },
+        "scenarios": results,
+    }
+
+
+# (name, path) served by the WSGI and ASGI handlers, the DRF viewsets under
+# both and the async views under ASGI, see store.async_views
+CONCURRENCY_TARGETS = [
+    ("products-list", "/store/products/", "/store/async/products/"),
+    ("collections-list", "/store/collections/", "/store/async/collections/"),
+]
+
+
+def bench_wsgi(path, requests, concurrency):
+    handler = WSGIHandler()
+    environ = RequestFactory(SERVER_NAME="localhost")._base_environ(PATH_INFO=path, REQUEST_METHOD="GET")
+
+    def request(i):
+        statuses = []
+        started = time.perf_counter()
+        response = handler(dict(environ), lambda status, headers: statuses.append(status))
+        b"".join(response)
+        response.close()
+        return (time.perf_counter() - started, int(statuses[0].split()[0]))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(request, range(requests)))
+    return (results, time.perf_counter() - started)
+
+
+async def bench_asgi(path, requests, concurrency):
+    handler = ASGIHandler()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(b"host", b"localhost")], "server": ("localhost", 80), "client": ("127.0.0.1", 0),
+    }
+    pending = iter(range(requests))
+    results = []
+
+    async def client():
+        for i in pending:
+            messages = []
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                messages.append(message)
+
+            started = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            results.append((time.perf_counter() - started, messages[0]["status"]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(concurrency)])
+    return (results, time.perf_counter() - started)
+
+
+def serve(server, path, requests, concurrency):
+    if server == "wsgi":
+        return bench_wsgi(path, requests, concurrency)
+    return asyncio.run(bench_asgi(path, requests, concurrency))
+
+
+def run_concurrency(requests=500, concurrency=(1, 50), targets=None, warmup=10):
+    """
+    Serves the catalog lists with the WSGI handler on a thread per client,
+    and with the ASGI handler on concurrent tasks. The handlers are called
+    in process, without sockets, against the configured database, which
+    they only read. Each run is preceded by warmup untimed requests.
+    """
+    results = {}
+    middleware = [name for name in settings.MIDDLEWARE if not name.startswith("debug_toolbar")]
+    with override_settings(DEBUG=False, MIDDLEWARE=middleware,
+                           ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "localhost"]):
+        for (name, sync_path, async_path) in CONCURRENCY_TARGETS:
+            if targets and name not in targets:
+                continue
+            for clients in concurrency:
+                runs = {}
+                for (server, path) in [("wsgi", sync_path), ("asgi", sync_path), ("asgi-async-views", async_path)]:
+                    serve(server, path, warmup, clients)
+                    runs[server] = serve(server, path, requests, clients)
+                for (server, (samples, seconds)) in runs.items():
+                    statuses = {}
+                    for (duration, status) in samples:
+                        statuses[str(status)] = statuses.get(str(status), 0) + 1
+                    results.setdefault(name, {}).setdefault(str(clients), {})[server] = {
+                        **summarize([duration for (duration, status) in samples], seconds),
+                        "statuses": statuses,
+                    }
+
+    return {
+        "meta": {
+            **environment(),
+            "requests": requests,
+            "warmup": warmup,
+            "concurrency": list(concurrency),
+        },
+        "targets": results,
+    }
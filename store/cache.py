@@ -0,0 +1,176 @@
+import calendar
+import hashlib
+import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .models import Customer
+
+VERSION_KEY = "store:version:{}"
+CUSTOMER_KEY = "store:customer:{}"
+# what the lists show of products besides their own fields: stock and order
+# counts, which checkout changes with update(), and the products counted in
+# each collection
+INVENTORY_VERSION = "store.inventory"
+COLLECTION_PRODUCTS_VERSION = "store.collection_products"
+
+
+def version_key(model):
+    # a model, or the name of anything else cached behind a version
+    name = model if isinstance(model, str) else model._meta.label_lower
+    return VERSION_KEY.format(name)
+
+
+def new_version():
+    # the time of the bump, for Last-Modified, and a random part that tells
+    # bumps of the same instant apart
+    return f"{time.time():.6f}:{uuid4().hex}"
+
+
+def version_time(version):
+    (seconds, separator, token) = version.partition(":")
+    return float(seconds) if separator else 0
+
+
+def get_versions(*models):
+    """
+    Return the current version token of each model. Tokens live in the shared
+    cache, so every worker sees a bump; a lost token is simply replaced by a
+    new one, which can only cause misses and never serves stale data.
+    """
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            token = new_version()
+            cache.add(key, token, None)
+            versions[key] = cache.get(key) or token
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*models):
+    def bump():
+        cache.set_many({version_key(model): new_version() for model in models}, None)
+
+    # bumping before commit would let a concurrent request cache the old rows
+    # under the new version
+    transaction.on_commit(bump)
+
+
+def get_customer_for_user(user_id):
+    """
+    Returns the customer of a user from a short-lived cache entry, creating
+    it only when the user has none (post_save normally created it already).
+    """
+    key = CUSTOMER_KEY.format(user_id)
+    customer = cache.get(key)
+    if customer is None:
+        customer = Customer.objects.filter(user_id=user_id).first()
+        if customer is None:
+            (customer, created) = Customer.objects.get_or_create(user_id=user_id)
+        cache.set(key, customer, settings.STORE_CUSTOMER_CACHE_TIMEOUT)
+    return customer
+
+
+def forget_customer(user_id):
+    transaction.on_commit(lambda: cache.delete(CUSTOMER_KEY.format(user_id)))
+
+
+def list_cache_key(request, models):
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    parts = [request.build_absolute_uri(request.path), query]
+    parts += get_versions(*models)
+    return "store:list:" + hashlib.md5("|".join(parts).encode()).hexdigest()
+
+
+class CachedListMixin:
+    """
+    Caches the list response keyed on the full query string and the versions
+    of cache_models, any save or delete of those models invalidates it.
+    """
+    cache_models = []
+    cache_timeout = settings.STORE_RESPONSE_CACHE_TIMEOUT
+
+    def get_list_cache_key(self, request):
+        return list_cache_key(request, self.cache_models)
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_list_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Sends ETag and Last-Modified on list and retrieve, and answers matching
+    If-None-Match/If-Modified-Since with 304 from a single MAX()/COUNT()
+    query, before the page is fetched or serialized. Last-Modified is the
+    latest of last_update and of the version bumps of cache_models, which
+    cover changes that do not touch last_update, such as new product images
+    or a renamed collection.
+    """
+    last_modified_field = "last_update"
+
+    def get_conditional_queryset(self):
+        # the plain model queryset keeps the aggregate free of the viewset's
+        # annotations and joins
+        return self.filter_queryset(self.get_queryset().model.objects.all())
+
+    def conditional_response(self, request, queryset, handler, *args, **kwargs):
+        stats = queryset.aggregate(
+            last_modified=Max(self.last_modified_field), count=Count("pk"))
+        if not stats["count"]:
+            return handler(request, *args, **kwargs)
+
+        versions = get_versions(*getattr(self, "cache_models", []))
+        last_modified = int(max(calendar.timegm(stats["last_modified"].utctimetuple()),
+                                *[version_time(version) for version in versions]))
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        parts = [request.build_absolute_uri(request.path), query,
+                 str(stats["count"]), stats["last_modified"].isoformat()]
+        parts += versions
+        etag = quote_etag(hashlib.md5("|".join(parts).encode()).hexdigest())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in [200, 304]:
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_conditional_queryset(), super().list, *args, **kwargs)
+
+    def get_lookup_queryset(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return self.get_conditional_queryset().filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            # a malformed id, get_object answers 404 as it does for any miss
+            return None
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.get_lookup_queryset()
+        if queryset is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(
+            request, queryset, super().retrieve, *args, **kwargs)
@@ -0,0 +1,87 @@
+import csv
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import OrderItem, Product
+
+# (column, lookup) pairs read with values_list(), no model instances or
+# serializers are built while exporting
+PRODUCT_COLUMNS = [
+    ("id", "id"),
+    ("title", "title"),
+    ("slug", "slug"),
+    ("unit_price", "unit_price"),
+    ("inventory", "inventory"),
+    ("collection_id", "collection_id"),
+    ("last_update", "last_update"),
+]
+
+ORDER_ITEM_COLUMNS = [
+    ("order_id", "order_id"),
+    ("placed_at", "order__placed_at"),
+    ("payment_status", "order__payment_status"),
+    ("customer_id", "order__customer_id"),
+    ("product_id", "product_id"),
+    ("quantity", "quantity"),
+    ("unit_price", "unit_price"),
+]
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def encode_csv(rows, columns):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for (column, lookup) in columns])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def encode_ndjson(rows, columns):
+    encoder = DjangoJSONEncoder()
+    names = [column for (column, lookup) in columns]
+    for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + "\n"
+
+
+FORMATS = {
+    "csv": (encode_csv, "text/csv"),
+    "ndjson": (encode_ndjson, "application/x-ndjson"),
+}
+
+
+def export(queryset, columns, file_format, chunk_size=CHUNK_SIZE):
+    """
+    Yields the encoded rows of queryset in blocks of chunk_size lines. The
+    rows come from iterator(), a server-side cursor on PostgreSQL, so memory
+    stays flat whatever the number of rows.
+    """
+    (encode, content_type) = FORMATS[file_format]
+    rows = queryset.values_list(*[lookup for (column, lookup) in columns]).iterator(chunk_size=chunk_size)
+    lines = encode(rows, columns)
+    while True:
+        block = "".join(islice(lines, chunk_size))
+        if not block:
+            return
+        yield block
+
+
+def products_queryset():
+    return Product.objects.order_by("id")
+
+
+def order_items_queryset():
+    return OrderItem.objects.order_by("order_id", "id")
+
+
+def streaming_response(queryset, columns, file_format, filename):
+    (encode, content_type) = FORMATS[file_format]
+    response = StreamingHttpResponse(export(queryset, columns, file_format), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{file_format}"'
+    return response
@@ -12,6 +12,25 @@ class ProductFilter(FilterSet):
         }
 
 
+class OrderFilter(FilterSet):
+    class Meta:
+        model = models.Order
+        fields = {
+            "placed_at": ["exact", "gte", "lte"],
+            "payment_status": ["exact"]
+        }
+
+
+class DailySalesRollupFilter(FilterSet):
+    class Meta:
+        model = models.DailySalesRollup
+        fields = {
+            "day": ["exact", "gte", "lte"],
+            "product_id": ["exact"],
+            "collection_id": ["exact"]
+        }
+
+
 class CustomerFilter(FilterSet):
     class Meta:
         model = models.Customer
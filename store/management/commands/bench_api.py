@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the store API through the URLconf and prints latencies and query counts as JSON"
+
+    def add_arguments(self, parser):
+        benchmark.add_arguments(parser, requests=100, warmup=10)
+        parser.add_argument("--scenario", action="append", dest="scenarios",
+                            help="Runs only this scenario, may be repeated")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--cold", action="store_true", help="Clears the cache before every request")
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmark.run(requests=options["requests"], warmup=options["warmup"],
+                                    names=options["scenarios"], seed=options["seed"],
+                                    cold=options["cold"])
+        except ValueError as error:
+            raise CommandError(str(error))
+        benchmark.write_results(results, options, self.stdout)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store import benchmark
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of the catalog lists under WSGI and ASGI at several concurrencies"
+
+    def add_arguments(self, parser):
+        benchmark.add_arguments(parser, requests=500, warmup=10)
+        parser.add_argument("--concurrency", type=int, action="append",
+                            help="Concurrent clients, may be repeated, defaults to 1 and 50")
+        parser.add_argument("--target", action="append", dest="targets",
+                            choices=[name for (name, sync_path, async_path) in benchmark.CONCURRENCY_TARGETS])
+
+    def handle(self, *args, **options):
+        results = benchmark.run_concurrency(requests=options["requests"],
+                                            concurrency=options["concurrency"] or [1, 50],
+                                            targets=options["targets"], warmup=options["warmup"])
+        benchmark.write_results(results, options, self.stdout)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.outbox import dispatch_pending
+
+
+class Command(BaseCommand):
+    help = "Delivers the events of the outbox to their receivers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=10)
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to wait when the outbox is empty")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the outbox and exit instead of polling")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                dispatched, failed = dispatch_pending(
+                    options["batch_size"], options["max_attempts"])
+                if dispatched or failed:
+                    self.stdout.write(f"dispatched {dispatched}, failed {failed}")
+                if dispatched + failed < options["batch_size"]:
+                    if options["once"]:
+                        break
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
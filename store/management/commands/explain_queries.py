@@ -0,0 +1,66 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from store import views
+from store.models import Customer, Product
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN on the querysets of the store viewsets and reports the indexes they use"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--analyze", action="store_true",
+                            help="Run EXPLAIN ANALYZE (PostgreSQL)")
+        parser.add_argument("--verbose-plan", action="store_true",
+                            help="Print the full query plan")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.index_names = [index.name
+                            for model in apps.get_app_config("store").get_models()
+                            for index in model._meta.indexes]
+
+        product = Product.objects.order_by("id").first()
+        customer = Customer.objects.select_related("user").order_by("id").first()
+
+        self.explain_view("products-list", views.ProductViewSet, "/store/products/")
+        self.explain_view("products-list (collection, price range)", views.ProductViewSet,
+                          "/store/products/", {"collection_id": product.collection_id if product else 1,
+                                               "unit_price__gt": 10, "unit_price__lt": 50})
+        self.explain_view("products-list (ordering=unit_price)", views.ProductViewSet,
+                          "/store/products/", {"ordering": "unit_price"})
+        self.explain_view("products-list (ordering=-last_update)", views.ProductViewSet,
+                          "/store/products/", {"ordering": "-last_update"})
+        if product is not None:
+            self.explain_view("product-reviews-list", views.ReviewViewSet,
+                              f"/store/products/{product.id}/reviews/",
+                              kwargs={"product_pk": product.id})
+        if customer is not None:
+            self.explain_view("orders-list (customer)", views.OrderViewSet, "/store/orders/",
+                              user=customer.user)
+        self.explain("admin low inventory", Product.objects.filter(inventory__lt=10))
+
+    def explain_view(self, name, viewset, path, params=None, kwargs=None, user=None):
+        request = APIRequestFactory().get(path, params or {})
+        if user is not None:
+            force_authenticate(request, user=user)
+        view = viewset(action_map={"get": "list"}, args=(), kwargs=kwargs or {}, format_kwarg=None)
+        view.request = view.initialize_request(request)
+        queryset = view.filter_queryset(view.get_queryset())
+        page_size = getattr(view.pagination_class, "page_size", None) or 10
+        self.explain(name, queryset[:page_size])
+
+    def explain(self, name, queryset):
+        options = {"analyze": True} if self.options["analyze"] else {}
+        plan = queryset.explain(**options)
+        used = [index for index in self.index_names if index in plan]
+
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        if used:
+            self.stdout.write(self.style.SUCCESS(f"  uses: {', '.join(used)}"))
+        else:
+            self.stdout.write(self.style.WARNING("  uses none of the store indexes"))
+        if self.options["verbose_plan"]:
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
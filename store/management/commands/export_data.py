@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import exports
+
+EXPORTS = {
+    "products": (exports.products_queryset, exports.PRODUCT_COLUMNS),
+    "orders": (exports.order_items_queryset, exports.ORDER_ITEM_COLUMNS),
+}
+
+
+class Command(BaseCommand):
+    help = "Streams products or order lines to a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("data", choices=list(EXPORTS))
+        parser.add_argument("--format", choices=list(exports.FORMATS), default="csv")
+        parser.add_argument("--output", help="Defaults to the standard output")
+        parser.add_argument("--chunk-size", type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        (queryset, columns) = EXPORTS[options["data"]]
+        started = time.perf_counter()
+
+        output = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else sys.stdout
+        try:
+            for block in exports.export(queryset(), columns, options["format"], options["chunk_size"]):
+                output.write(block)
+        finally:
+            if options["output"]:
+                output.close()
+
+        if options["output"]:
+            self.stdout.write(self.style.SUCCESS(
+                f"Exported {options['data']} to {options['output']} in {time.perf_counter() - started:.2f}s"))
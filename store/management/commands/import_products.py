@@ -0,0 +1,84 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+
+from store.cache import COLLECTION_PRODUCTS_VERSION, bump_versions
+from store.models import Collection, Product
+from store.provisioning import PRODUCT_FIELDS, format_of, read_rows, upsert_products
+from store.search import invalidate_index
+
+
+class Command(BaseCommand):
+    help = "Imports or updates products, keyed on slug, from a CSV or NDJSON file in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "ndjson"],
+                            help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--create-collections", action="store_true",
+                            help="Creates collections that no title matches instead of failing")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or format_of(path)
+        self.create_collections = options["create_collections"]
+        # title -> id, read once and filled in as collections are created,
+        # the oldest collection wins when titles repeat
+        self.collections = dict(Collection.objects.order_by("-id").values_list("title", "id"))
+        self.collection_ids = set(self.collections.values())
+
+        with open(path, newline="", encoding="utf-8") as file:
+            try:
+                result = upsert_products(self.validate(read_rows(file, file_format)), options["batch_size"])
+            except ValidationError as error:
+                raise CommandError(" ".join(error.messages))
+
+        bump_versions(Product, Collection, COLLECTION_PRODUCTS_VERSION)
+        invalidate_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} and updated {result['updated']} products in {result['seconds']}s "
+            f"({result['rows_per_second']} rows/s)"))
+
+    def validate(self, rows):
+        for (number, row) in enumerate(rows, start=1):
+            try:
+                product = Product(
+                    title=row.get("title"),
+                    slug=row.get("slug") or slugify(row.get("title", "")),
+                    description=row.get("description"),
+                    unit_price=row.get("unit_price"),
+                    inventory=row.get("inventory"),
+                    collection_id=self.collection_id(row),
+                )
+                # the fields a row leaves out keep their value on an existing
+                # product, upsert_products rejects new products without them.
+                # The collection was resolved above, checking it would cost a
+                # query per row
+                omitted = [field.name for field in Product._meta.concrete_fields
+                           if field.attname in PRODUCT_FIELDS and getattr(product, field.attname) is None]
+                product.full_clean(exclude=omitted + ["collection"], validate_unique=False)
+            except ValidationError as error:
+                raise CommandError(f"Invalid row {number}: {'; '.join(error.messages)}")
+            yield product
+
+    def collection_id(self, row):
+        if "collection_id" in row:
+            try:
+                collection_id = int(row["collection_id"])
+            except (TypeError, ValueError):
+                raise ValidationError(f"collection_id {row['collection_id']} is not a number.")
+            if collection_id not in self.collection_ids:
+                raise ValidationError(f"Collection {collection_id} does not exist.")
+            return collection_id
+
+        title = row.get("collection")
+        if title is None:
+            return None
+        if title not in self.collections:
+            if not self.create_collections:
+                raise ValidationError(f"No collection is titled {title}.")
+            collection = Collection.objects.create(title=title)
+            self.collections[title] = collection.id
+            self.collection_ids.add(collection.id)
+        return self.collections[title]
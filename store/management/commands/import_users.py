@@ -0,0 +1,40 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from store.provisioning import batches, bulk_create_users, format_of, read_rows
+from store.serializers import UserImportSerializer
+
+
+class Command(BaseCommand):
+    help = "Imports users and their customers from a CSV or NDJSON file in batched inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "ndjson"],
+                            help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or format_of(path)
+
+        with open(path, newline="", encoding="utf-8") as file:
+            rows = read_rows(file, file_format)
+            try:
+                result = bulk_create_users(self.validate(rows, options["batch_size"]),
+                                           options["batch_size"])
+            except ValidationError as error:
+                raise CommandError(" ".join(error.messages))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} users and customers in {result['seconds']}s "
+            f"({result['rows_per_second']} rows/s)"))
+
+    def validate(self, rows, batch_size):
+        for (number, batch) in enumerate(batches(rows, batch_size)):
+            serializer = UserImportSerializer(data=batch, many=True)
+            if not serializer.is_valid():
+                errors = {number * batch_size + index + 1: error
+                          for (index, error) in enumerate(serializer.errors) if error}
+                raise CommandError(f"Invalid rows: {errors}")
+            yield from serializer.validated_data
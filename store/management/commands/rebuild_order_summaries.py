@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.summaries import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recomputes order totals and customer order statistics from the order items"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild()
+        self.stdout.write(self.style.SUCCESS("Order summaries rebuilt."))
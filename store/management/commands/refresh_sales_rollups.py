@@ -0,0 +1,26 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from store.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = "Rolls up order items into daily sales per product and collection, only new days by default"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=date.fromisoformat,
+                            help="Recompute from this day (YYYY-MM-DD) instead of the day after the last rollup")
+        parser.add_argument("--until", type=date.fromisoformat,
+                            help="Last day to roll up, defaults to yesterday")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        days = refresh_rollups(options["since"], options["until"])
+        if days:
+            self.stdout.write(self.style.SUCCESS(
+                f"Rolled up {len(days)} day(s) ({days[0]} to {days[-1]}) "
+                f"in {time.perf_counter() - started:.2f}s"))
+        else:
+            self.stdout.write("Nothing to roll up.")
@@ -0,0 +1,59 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The search vector is maintained by a trigger and served by a GIN index.
+# Both only exist on PostgreSQL, other databases keep an unused column and
+# search through store.search.InvertedIndexSearchBackend.
+
+CREATE_TRIGGER = """
+CREATE FUNCTION store_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(
+            (SELECT title FROM store_collection WHERE id = NEW.collection_id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER store_product_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, description, collection_id, search_vector ON store_product
+FOR EACH ROW EXECUTE PROCEDURE store_product_search_vector_update();
+
+CREATE INDEX store_product_search_vector_gin ON store_product USING gin (search_vector);
+
+UPDATE store_product SET search_vector = NULL;
+"""
+
+DROP_TRIGGER = """
+DROP INDEX IF EXISTS store_product_search_vector_gin;
+DROP TRIGGER IF EXISTS store_product_search_vector_trigger ON store_product;
+DROP FUNCTION IF EXISTS store_product_search_vector_update();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
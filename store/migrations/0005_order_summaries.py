@@ -0,0 +1,61 @@
+# Generated by Django 3.2 on 2026-10-17 19:47
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_summaries(apps, schema_editor):
+    Customer = apps.get_model("store", "Customer")
+    Order = apps.get_model("store", "Order")
+    OrderItem = apps.get_model("store", "OrderItem")
+
+    items = OrderItem.objects.filter(order_id=OuterRef("pk")).order_by().values("order_id")
+    Order.objects.update(
+        total=Coalesce(Subquery(items.annotate(total=Sum(
+            F("quantity") * F("unit_price"), output_field=models.DecimalField())).values("total")),
+            Value(0), output_field=models.DecimalField()),
+        items_count=Coalesce(Subquery(items.annotate(count=Count("id")).values("count")), Value(0)))
+
+    orders = Order.objects.filter(customer_id=OuterRef("pk")).order_by().values("customer_id")
+    Customer.objects.update(
+        orders_count=Coalesce(Subquery(orders.annotate(count=Count("id")).values("count")), Value(0)),
+        lifetime_spend=Coalesce(Subquery(orders.annotate(spend=Sum("total")).values("spend")),
+                                Value(0), output_field=models.DecimalField()),
+        last_order_at=Subquery(orders.annotate(last=Max("placed_at")).values("last")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_at',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='lifetime_spend',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='orders_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
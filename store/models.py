@@ -1,8 +1,12 @@
 from uuid import uuid4
 
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, ExpressionWrapper, F, Prefetch, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 
 # Create your models here.
@@ -28,6 +32,35 @@ class Collection(models.Model):
         return self.title
 
 
+class ProductQuerySet(models.QuerySet):
+    def decrement_inventory(self, quantities):
+        """
+        Takes {product_id: quantity} off the inventory with one conditional
+        UPDATE and returns the ids of the products short of stock, in which
+        case nothing is changed. Must run inside a transaction.
+        """
+        product_ids = sorted(quantities)
+
+        # locking in id order keeps concurrent checkouts of the same products
+        # from deadlocking
+        inventory = dict(self.select_for_update().filter(
+            pk__in=product_ids).order_by("pk").values_list("pk", "inventory"))
+        short = [product_id for product_id in product_ids
+                 if inventory.get(product_id, 0) < quantities[product_id]]
+        if short:
+            return short
+
+        quantity = Case(*[When(pk=product_id, then=Value(quantities[product_id]))
+                          for product_id in product_ids], output_field=models.IntegerField())
+        # update() skips auto_now, Last-Modified reads last_update
+        updated = self.filter(pk__in=product_ids, inventory__gte=quantity).update(
+            inventory=F("inventory") - quantity, last_update=timezone.now())
+        if updated != len(product_ids):
+            # only reachable on databases without row locks
+            return product_ids
+        return []
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -38,14 +71,36 @@ class Product(models.Model):
                                      )
     inventory = models.IntegerField(validators=[MinValueValidator(1)])
     last_update = models.DateTimeField(auto_now=True)
-    collection = models.ForeignKey(Collection, on_delete=models.PROTECT)
+    # indexed first in store_prod_coll_price_idx
+    collection = models.ForeignKey(Collection, on_delete=models.PROTECT, db_index=False)
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    objects = ProductQuerySet.as_manager()
+    # maintained by a database trigger on PostgreSQL, see store.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # lets store.signals tell a move to another collection from other saves
+        product._loaded_collection_id = dict(zip(field_names, values)).get("collection_id")
+        return product
+
     class Meta:
         ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["collection", "unit_price"],
+                         name="store_prod_coll_price_idx"),
+            models.Index(fields=["unit_price"], name="store_prod_price_idx"),
+            models.Index(fields=["last_update"],
+                         name="store_prod_last_update_idx"),
+            # ProductAdmin's InventoryFilter only ever looks at low stock
+            models.Index(fields=["inventory"], name="store_prod_low_inv_idx",
+                         condition=models.Q(inventory__lt=10)),
+        ]
 
 
 class ProductImage(models.Model):
@@ -54,11 +109,18 @@ class ProductImage(models.Model):
 
 
 class Review(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # indexed first in store_review_prod_date_idx
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "date"],
+                         name="store_review_prod_date_idx"),
+        ]
+
 
 class Customer(models.Model):
     MEMBERSHIP_BRONZE = "B"
@@ -79,6 +141,12 @@ class Customer(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    # summaries of the customer's orders, see store.summaries
+    orders_count = models.PositiveIntegerField(default=0, editable=False)
+    lifetime_spend = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, editable=False)
+    last_order_at = models.DateField(null=True, editable=False)
+
     def __str__(self) -> str:
         return f"{self.user.first_name} {self.user.last_name}"
 
@@ -114,11 +182,23 @@ class Order(models.Model):
     placed_at = models.DateField(auto_now_add=True)
     payment_status = models.CharField(
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
-    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    # indexed first in store_order_cust_placed_idx
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, db_index=False)
+    # the sum and count of the order's items, see store.summaries
+    total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False)
+    items_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return str(self.placed_at)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["customer", "placed_at"],
+                         name="store_order_cust_placed_idx"),
+            models.Index(fields=["placed_at"], name="store_order_placed_idx"),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
@@ -130,22 +210,169 @@ class OrderItem(models.Model):
         return str(self.product)
 
 
+class DailySalesRollup(models.Model):
+    # built from OrderItem by the refresh_sales_rollups command
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        unique_together = [["day", "product"]]
+        indexes = [
+            models.Index(fields=["collection", "day"],
+                         name="store_rollup_coll_day_idx"),
+        ]
+
+
+class CartQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=Coalesce(
+            Sum(F("cartitem__quantity") * F("cartitem__product__unit_price"),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+            Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2)))
+
+    def with_items(self):
+        return self.with_total_price().prefetch_related(Prefetch(
+            "cartitem_set",
+            queryset=CartItem.objects.with_total_price().select_related("product")))
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self) -> str:
         return str(self.id)
 
 
+# the largest value of the PositiveSmallIntegerField on every database
+CART_ITEM_MAX_QUANTITY = 32767
+# lines per INSERT, two parameters each
+UPSERT_BATCH_SIZE = 400
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=ExpressionWrapper(
+            F("quantity") * F("product__unit_price"),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)))
+
+    def add_product(self, cart_id, product_id, quantity):
+        """
+        Adds quantity of a product to a cart, creating the line if needed, and
+        returns the line or None when the product does not exist.
+        """
+        return self.add_products(cart_id, {product_id: quantity}).get(product_id)
+
+    def add_products(self, cart_id, quantities):
+        """
+        Adds {product_id: quantity} to a cart, creating the lines as needed,
+        and returns the lines by product id, leaving out the products that do
+        not exist. Quantities stop at CART_ITEM_MAX_QUANTITY.
+        """
+        connection = connections[self.db]
+        product_ids = sorted(quantities)
+        if connection.vendor == "postgresql" or (
+                connection.vendor == "sqlite" and connection.Database.sqlite_version_info >= (3, 35)):
+            batches = [product_ids[start:start + UPSERT_BATCH_SIZE]
+                       for start in range(0, len(product_ids), UPSERT_BATCH_SIZE)]
+            if len(batches) == 1:
+                return self._upsert_products(connection, cart_id, quantities)
+            with transaction.atomic(using=self.db):
+                items = {}
+                for batch in batches:
+                    items.update(self._upsert_products(
+                        connection, cart_id, {product_id: quantities[product_id] for product_id in batch}))
+                return items
+
+        with transaction.atomic(using=self.db):
+            found = set(Product.objects.using(self.db).filter(
+                pk__in=product_ids).values_list("pk", flat=True))
+            items = {}
+            for product_id in product_ids:
+                if product_id not in found:
+                    continue
+                quantity = quantities[product_id]
+                cart_item, created = self.select_for_update().get_or_create(
+                    cart_id=cart_id, product_id=product_id, defaults={"quantity": quantity})
+                if not created:
+                    self.filter(pk=cart_item.pk).update(quantity=Case(
+                        When(quantity__gt=CART_ITEM_MAX_QUANTITY - quantity, then=Value(CART_ITEM_MAX_QUANTITY)),
+                        default=F("quantity") + quantity, output_field=models.IntegerField()))
+                    cart_item.refresh_from_db(fields=["quantity"])
+                items[product_id] = cart_item
+            return items
+
+    def _upsert_products(self, connection, cart_id, quantities):
+        # one statement that checks the products, inserts the lines or adds to
+        # them, so concurrent adds can no longer collide on (cart, product);
+        # lines are written in product order, which keeps concurrent adds to
+        # the same cart from deadlocking
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        product_table = quote(Product._meta.db_table)
+        quantity = f"{table}.{quote('quantity')}"
+        values = ", ".join(["(%s, %s)"] * len(quantities))
+        sql = f"""
+            INSERT INTO {table} ({quote("cart_id")}, {quote("product_id")}, {quote("quantity")})
+            SELECT %s, {product_table}.{quote("id")}, line.column2
+            FROM (VALUES {values}) AS line, {product_table}
+            WHERE {product_table}.{quote("id")} = line.column1
+            ORDER BY {product_table}.{quote("id")}
+            ON CONFLICT ({quote("cart_id")}, {quote("product_id")})
+            DO UPDATE SET {quote("quantity")} = CASE
+                WHEN {quantity} > %s - excluded.{quote("quantity")} THEN %s
+                ELSE {quantity} + excluded.{quote("quantity")} END
+            RETURNING {quote("id")}, {quote("product_id")}, {quote("quantity")}
+        """
+        cart_id = self.model._meta.get_field("cart").get_db_prep_value(cart_id, connection)
+        params = [cart_id]
+        for product_id in sorted(quantities):
+            params += [product_id, quantities[product_id]]
+        params += [CART_ITEM_MAX_QUANTITY, CART_ITEM_MAX_QUANTITY]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return {
+            product_id: self.model.from_db(self.db, ["id", "cart_id", "product_id", "quantity"],
+                                           [item_id, cart_id, product_id, quantity])
+            for (item_id, product_id, quantity) in rows
+        }
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(
         validators=[MinValueValidator(1)])
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [["cart", "product"]]
 
     def __str__(self) -> str:
         return str(self.product)
+
+
+class OutboxEvent(models.Model):
+    topic = models.CharField(max_length=255)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.topic} #{self.id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["available_at"], name="store_outbox_pending_idx",
+                         condition=models.Q(dispatched_at__isnull=True)),
+        ]
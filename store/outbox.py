@@ -0,0 +1,66 @@
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OutboxEvent
+from .signals import order_created
+
+
+def publish(topic, **payload):
+    """
+    Records an event in the outbox. Call it inside the transaction that makes
+    the change, the event then exists if and only if the change is committed.
+    """
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def send_order_created(payload):
+    order = Order.objects.get(pk=payload["order_id"])
+    order_created.send(sender=Order, order=order)
+
+
+HANDLERS = {
+    "order_created": send_order_created,
+}
+
+
+def dispatch_pending(batch_size=100, max_attempts=10):
+    """
+    Delivers one batch of pending events and returns (dispatched, failed).
+    Delivery is at least once: an event is marked dispatched only after its
+    receivers ran, so receivers have to be idempotent. Failed events are
+    retried with exponential backoff until max_attempts.
+    """
+    now = timezone.now()
+    dispatched = failed = 0
+
+    with transaction.atomic():
+        events = OutboxEvent.objects.filter(
+            dispatched_at__isnull=True, available_at__lte=now, attempts__lt=max_attempts
+        ).order_by("id")
+        # several workers can share the outbox when the database can skip
+        # rows another worker holds
+        if connection.features.has_select_for_update_skip_locked:
+            events = events.select_for_update(skip_locked=True)
+
+        events = list(events[:batch_size])
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    HANDLERS[event.topic](event.payload)
+            except Exception:
+                event.last_error = traceback.format_exc()
+                event.available_at = timezone.now() + timedelta(seconds=min(2 ** event.attempts, 3600))
+                failed += 1
+            else:
+                event.last_error = ""
+                event.dispatched_at = timezone.now()
+                dispatched += 1
+
+        OutboxEvent.objects.bulk_update(
+            events, ["attempts", "last_error", "available_at", "dispatched_at"])
+
+    return dispatched, failed
@@ -1,5 +1,55 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+class DefaultCursorPagination(CursorPagination):
+    page_size = 10
+    ordering = "-id"
+
+    def get_ordering(self, request, queryset, view):
+        # an OrderingFilter without ?ordering= falls back to the ordering
+        # declared on the pagination class instead of failing
+        ordering = None
+        for backend in getattr(view, "filter_backends", []):
+            if hasattr(backend, "get_ordering"):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = self.ordering
+        if isinstance(ordering, str):
+            ordering = [ordering]
+
+        # the cursor only encodes the first field and resolves ties on it with
+        # an offset, so a unique tiebreaker keeps pages stable for eg. unit_price
+        if not any(field.lstrip("-") in ["id", "pk"] for field in ordering):
+            ordering = list(ordering) + ["-id"]
+        return tuple(ordering)
+
+
+class ReviewCursorPagination(DefaultCursorPagination):
+    ordering = "-date"
+
+
+class CursorPaginationMixin:
+    """
+    Opt-in keyset pagination: ?pagination=cursor (or a ?cursor= taken from a
+    next/previous link) switches the view to cursor_pagination_class, which
+    pages with WHERE on the ordering instead of OFFSET and never runs COUNT(*).
+    """
+    cursor_pagination_class = None
+
+    def use_cursor_pagination(self):
+        request = getattr(self, "request", None)
+        if self.cursor_pagination_class is None or request is None:
+            return False
+        return (request.query_params.get("pagination") == "cursor"
+                or "cursor" in request.query_params)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator") and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,154 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Customer, Product
+
+CUSTOMER_FIELDS = ["phone", "birth_date", "membership"]
+PRODUCT_FIELDS = ["title", "description", "unit_price", "inventory", "collection_id", "last_update"]
+# what a new product cannot do without, existing ones keep their value
+REQUIRED_PRODUCT_FIELDS = ["title", "unit_price", "inventory", "collection_id"]
+
+
+def format_of(path):
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def read_rows(file, file_format):
+    """
+    Yields the rows of a CSV or NDJSON file as dicts, one line at a time.
+    Empty cells and nulls mean "not given" and are left out.
+    """
+    if file_format == "csv":
+        rows = csv.DictReader(file)
+    else:
+        rows = (json.loads(line) for line in file if line.strip())
+    for row in rows:
+        yield {key: value for (key, value) in row.items() if value not in ["", None]}
+
+
+def batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_create_users(rows, batch_size=1000):
+    """
+    Creates users and their customers with batched INSERTs in one transaction.
+    bulk_create sends no post_save, so create_customer_for_new_user does not
+    run and the customers are inserted here, keeping one customer per user.
+
+    rows are validated dicts (see UserImportSerializer) and may be any
+    iterable. Rows without a password get an unusable one, hashing passwords
+    dominates the cost of an import. Raises ValidationError on a username or
+    email that is taken, in which case nothing is created.
+    """
+    User = get_user_model()
+    started = time.perf_counter()
+    created = 0
+    usernames, emails = set(), set()
+
+    with transaction.atomic():
+        for batch in batches(rows, batch_size):
+            batch_usernames = [row["username"] for row in batch]
+            batch_emails = [row["email"] for row in batch]
+            taken = (usernames.intersection(batch_usernames) | emails.intersection(batch_emails)
+                     | set(User.objects.filter(username__in=batch_usernames).values_list("username", flat=True))
+                     | set(User.objects.filter(email__in=batch_emails).values_list("email", flat=True)))
+            if taken or len(set(batch_usernames)) < len(batch) or len(set(batch_emails)) < len(batch):
+                raise ValidationError(
+                    f"Usernames or emails are duplicated or already taken: {', '.join(sorted(taken)) or 'within the batch'}.")
+            usernames.update(batch_usernames)
+            emails.update(batch_emails)
+
+            users = User.objects.bulk_create([
+                User(username=row["username"], email=row["email"],
+                     first_name=row.get("first_name", ""), last_name=row.get("last_name", ""),
+                     password=make_password(row.get("password")))
+                for row in batch
+            ])
+            # databases that cannot return ids from a bulk insert (SQLite)
+            # are asked for them
+            if any(user.pk is None for user in users):
+                ids = dict(User.objects.filter(username__in=batch_usernames).values_list("username", "id"))
+            else:
+                ids = {user.username: user.pk for user in users}
+
+            Customer.objects.bulk_create([
+                Customer(user_id=ids[row["username"]],
+                         **{field: row[field] for field in CUSTOMER_FIELDS if row.get(field) is not None})
+                for row in batch
+            ])
+            created += len(batch)
+
+    seconds = time.perf_counter() - started
+    return {
+        "created": created,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(created / seconds) if seconds else created,
+    }
+
+
+def upsert_products(products, batch_size=1000):
+    """
+    Inserts or updates products keyed on slug in one transaction. Each batch
+    runs a SELECT of the existing slugs, a bulk_update per set of given
+    fields and a bulk_create of the new products. slug is not unique, so a
+    slug that several products share updates the oldest of them, and a slug
+    repeated in the feed keeps its last row.
+
+    products are unsaved, validated Product instances and may be any
+    iterable. Fields that are None were not given: they keep their value on
+    existing products and raise ValidationError on new ones, in which case
+    nothing is written. Bulk writes send no signals, callers bump the catalog
+    cache.
+    """
+    started = time.perf_counter()
+    created = updated = 0
+
+    with transaction.atomic():
+        for batch in batches(products, batch_size):
+            batch = list({product.slug: product for product in batch}.values())
+            existing = dict(Product.objects.filter(slug__in=[product.slug for product in batch])
+                            .order_by("-id").values_list("slug", "id"))
+            now = timezone.now()
+            for product in batch:
+                product.pk = existing.get(product.slug)
+                product.last_update = now
+
+            updates = [product for product in batch if product.pk is not None]
+            incomplete = sorted(product.slug for product in batch if product.pk is None and any(
+                getattr(product, field) is None for field in REQUIRED_PRODUCT_FIELDS))
+            if incomplete:
+                raise ValidationError(
+                    f"New products need a {', '.join(REQUIRED_PRODUCT_FIELDS)}: {', '.join(incomplete)}.")
+            # one UPDATE per set of fields given, a field left out of a row
+            # keeps its stored value
+            by_fields = {}
+            for product in updates:
+                fields = tuple(field for field in PRODUCT_FIELDS if getattr(product, field) is not None)
+                by_fields.setdefault(fields, []).append(product)
+            for (fields, products) in by_fields.items():
+                Product.objects.bulk_update(products, fields)
+            Product.objects.bulk_create([product for product in batch if product.pk is None])
+            updated += len(updates)
+            created += len(batch) - len(updates)
+
+    seconds = time.perf_counter() - started
+    return {
+        "created": created,
+        "updated": updated,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round((created + updated) / seconds) if seconds else created + updated,
+    }
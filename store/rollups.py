@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, Min, Sum
+from django.utils import timezone
+
+from .models import DailySalesRollup, Order, OrderItem
+
+
+def rollup_day(day):
+    """
+    Replaces the rollup rows of one day with the revenue and units of its
+    order items, grouped by product.
+    """
+    rows = OrderItem.objects.filter(order__placed_at=day).values(
+        "product_id", "product__collection_id"
+    ).annotate(
+        units=Sum("quantity"),
+        revenue=Sum(F("quantity") * F("unit_price"), output_field=DecimalField()),
+    ).order_by()
+
+    with transaction.atomic():
+        DailySalesRollup.objects.filter(day=day).delete()
+        DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(day=day, product_id=row["product_id"],
+                             collection_id=row["product__collection_id"],
+                             units=row["units"], revenue=row["revenue"])
+            for row in rows
+        ], batch_size=1000)
+
+
+def refresh_rollups(since=None, until=None):
+    """
+    Rolls up every day with orders from since, by default the day after the
+    last rolled up one, to until, by default yesterday: the current day is
+    only rolled up once it is complete. Returns the days processed.
+    """
+    if until is None:
+        until = timezone.localdate() - timedelta(days=1)
+    if since is None:
+        last_day = DailySalesRollup.objects.aggregate(last_day=Max("day"))["last_day"]
+        if last_day is None:
+            since = Order.objects.aggregate(first_day=Min("placed_at"))["first_day"]
+        else:
+            since = last_day + timedelta(days=1)
+    if since is None or since > until:
+        return []
+
+    # days without orders are skipped but may hold rows of since-deleted orders
+    DailySalesRollup.objects.filter(day__range=(since, until)).exclude(
+        day__in=Order.objects.filter(placed_at__range=(since, until)).values("placed_at")
+    ).delete()
+
+    days = list(Order.objects.filter(placed_at__range=(since, until)).dates("placed_at", "day"))
+    for day in days:
+        rollup_day(day)
+    return days
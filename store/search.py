@@ -0,0 +1,134 @@
+import json
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+
+from .cache import bump_versions, get_versions
+from .models import Product
+
+TOKEN_RE = re.compile(r"\w+")
+# bumped when the searched text of products may have changed, unlike the
+# Product version that every checkout bumps
+INDEX_VERSION = "store.search_index"
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+class PostgresSearchBackend:
+    """
+    Matches every term as a prefix against Product.search_vector, which a
+    trigger keeps up to date (see migration 0002), and orders by rank.
+    """
+    config = "english"
+
+    def search(self, queryset, terms):
+        query = SearchQuery(" & ".join(f"{term}:*" for term in terms),
+                            config=self.config, search_type="raw")
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F("search_vector"), query)
+        ).order_by("-search_rank", "-id")
+
+
+class InvertedIndexSearchBackend:
+    """
+    In-process inverted index over the title, description and collection
+    title of every product, for SQLite and tests. It is rebuilt when
+    INDEX_VERSION changes, see invalidate_index.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = None
+        self.index = {}
+        self.vocabulary = []
+
+    def build(self):
+        index = defaultdict(set)
+        rows = Product.objects.values_list(
+            "id", "title", "description", "collection__title")
+        for (product_id, *texts) in rows.iterator():
+            for token in tokenize(" ".join(filter(None, texts))):
+                index[token].add(product_id)
+        return dict(index)
+
+    def get_index(self):
+        versions = get_versions(INDEX_VERSION)
+        with self.lock:
+            if versions != self.versions:
+                self.index = self.build()
+                self.vocabulary = sorted(self.index)
+                self.versions = versions
+            return self.index, self.vocabulary
+
+    def lookup(self, term):
+        index, vocabulary = self.get_index()
+        matches = set()
+        position = bisect_left(vocabulary, term)
+        while position < len(vocabulary) and vocabulary[position].startswith(term):
+            matches |= index[vocabulary[position]]
+            position += 1
+        return matches
+
+    def search(self, queryset, terms):
+        ids = None
+        for term in terms:
+            matches = self.lookup(term)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return queryset.none()
+        return queryset.filter(pk__in=self.id_list(connections[queryset.db], sorted(ids)))
+
+    def id_list(self, connection, ids):
+        # short prefixes match much of the catalog, passed as a single
+        # parameter the ids stay below the variable limit of SQLite
+        if connection.vendor == "sqlite":
+            return RawSQL("SELECT value FROM json_each(%s)", [json.dumps(ids)])
+        if connection.vendor == "postgresql":
+            return RawSQL("SELECT unnest(%s::bigint[])", [ids])
+        return ids
+
+
+def invalidate_index():
+    bump_versions(INDEX_VERSION)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            path = settings.STORE_SEARCH_BACKEND
+            if path is None:
+                path = ("store.search.PostgresSearchBackend"
+                        if connection.vendor == "postgresql"
+                        else "store.search.InvertedIndexSearchBackend")
+            _backend = import_string(path)()
+        return _backend
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on products that delegates ?search=
+    to the configured search backend instead of icontains lookups.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = [token for term in self.get_search_terms(request)
+                 for token in tokenize(term)]
+        if not terms:
+            return queryset
+        return get_search_backend().search(queryset, terms)
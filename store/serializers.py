@@ -1,8 +1,9 @@
 from decimal import Decimal
+from django.contrib.auth import get_user_model
 from django.db import transaction
 from rest_framework import serializers
-from .signals import order_created
-from . import models
+from .cache import INVENTORY_VERSION, bump_versions
+from . import models, outbox, summaries
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -43,6 +44,8 @@ class ProductSerializer(serializers.ModelSerializer):
         return product.collection.title
 
     def calculate_orders_count(self, product: models.Product):
+        if hasattr(product, "orders_count"):
+            return product.orders_count
         return product.orderitem_set.count()
 
     def calculate_tax(self, product: models.Product):
@@ -89,6 +92,8 @@ class CartItemSerializer(serializers.ModelSerializer):
         method_name="get_total_price")
 
     def get_total_price(self, cartitem: models.CartItem):
+        if hasattr(cartitem, "total_price"):
+            return cartitem.total_price
         return cartitem.product.unit_price * cartitem.quantity
 
     class Meta:
@@ -99,25 +104,17 @@ class CartItemSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not models.Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                "Product with the given id does not exists.")
-        return value
-
     def save(self, **kwargs):
         cart_id = self.context["cart_id"]
         product_id = self.validated_data["product_id"]
         quantity = self.validated_data["quantity"]
-        try:
-            cart_item = models.CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except models.CartItem.DoesNotExist:
-            self.instance = models.CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+
+        # the product check is part of the upsert statement
+        self.instance = models.CartItem.objects.add_product(
+            cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError(
+                {"product_id": ["Product with the given id does not exists."]})
 
         return self.instance
 
@@ -126,6 +123,41 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ["id", "product_id", "quantity"]
 
 
+class CartItemLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=models.CART_ITEM_MAX_QUANTITY)
+
+
+class BulkAddCartItemSerializer(serializers.Serializer):
+    items = CartItemLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        quantities = {}
+        for item in items:
+            quantities[item["product_id"]] = quantities.get(
+                item["product_id"], 0) + item["quantity"]
+
+        too_many = sorted(product_id for (product_id, quantity) in quantities.items()
+                          if quantity > models.CART_ITEM_MAX_QUANTITY)
+        if too_many:
+            raise serializers.ValidationError(
+                f"Quantities of a product may not add up to more than {models.CART_ITEM_MAX_QUANTITY}: "
+                f"{', '.join(map(str, too_many))}.")
+
+        found = set(models.Product.objects.filter(
+            pk__in=quantities).values_list("pk", flat=True))
+        missing = sorted(set(quantities) - found)
+        if missing:
+            raise serializers.ValidationError(
+                f"Products with the given ids do not exist: {', '.join(map(str, missing))}.")
+        return quantities
+
+    def save(self, **kwargs):
+        # the same upsert as single adds, so concurrent adds of a new product
+        # to the cart add up instead of colliding on (cart, product)
+        return models.CartItem.objects.add_products(self.context["cart_id"], self.validated_data["items"])
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.CartItem
@@ -139,6 +171,8 @@ class CartSerializer(serializers.ModelSerializer):
         method_name="get_total_price")
 
     def get_total_price(self, cart: models.Cart):
+        if hasattr(cart, "total_price"):
+            return cart.total_price
         return sum([item.quantity * item.product.unit_price for item in cart.cartitem_set.all()])
 
     class Meta:
@@ -153,6 +187,16 @@ class CustomerSerializer(serializers.ModelSerializer):
         model = models.Customer
         fields = ["id", "user_id", "phone", "birth_date", "membership"]
 
+    def update(self, instance, validated_data):
+        # only the fields that really changed are written
+        changed = [field for (field, value) in validated_data.items()
+                   if getattr(instance, field) != value]
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        if changed:
+            instance.save(update_fields=changed)
+        return instance
+
     """
     full_name = serializers.SerializerMethodField(method_name="get_full_name")
 
@@ -161,6 +205,25 @@ class CustomerSerializer(serializers.ModelSerializer):
     """
 
 
+class UserImportSerializer(serializers.Serializer):
+    # bulk_create_users skips full_clean, so the model's validator runs here
+    username = serializers.CharField(max_length=150, validators=[get_user_model().username_validator])
+    email = serializers.EmailField()
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True)
+    password = serializers.CharField(required=False, write_only=True)
+    phone = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    birth_date = serializers.DateField(required=False, allow_null=True)
+    membership = serializers.ChoiceField(
+        choices=models.Customer.MEMBERSHIP_CHOICES, required=False)
+
+
+class CustomerSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Customer
+        fields = ["id", "orders_count", "lifetime_spend", "last_order_at"]
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
@@ -176,7 +239,7 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Order
         fields = ["id", "customer_id", "placed_at",
-                  "payment_status", "orderitem_set"]
+                  "payment_status", "total", "orderitem_set"]
 
 
 class CreateOrderSerializer(serializers.Serializer):
@@ -195,15 +258,33 @@ class CreateOrderSerializer(serializers.Serializer):
             user_id = self.context["user_id"]
             cart_id = self.validated_data["cart_id"]
 
+            # locking the cart, a second checkout of it waits here and then
+            # finds it gone or emptied
+            if not models.Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                raise serializers.ValidationError({"cart_id": ["No cart with the given ID was found."]})
+
+            # getting cart items by cart_id
+            cart_items = list(models.CartItem.objects.select_related(
+                "product").filter(cart_id=cart_id))
+            if not cart_items:
+                raise serializers.ValidationError({"cart_id": ["The cart is empty."]})
+
+            # reserving the stock, the whole checkout rolls back when short
+            short = models.Product.objects.decrement_inventory(
+                {item.product_id: item.quantity for item in cart_items})
+            if short:
+                raise serializers.ValidationError({"cart_id": [
+                    f"Not enough inventory for products: {', '.join(map(str, short))}."]})
+
             # getting the customer by user_id
             customer = models.Customer.objects.get(user_id=user_id)
 
-            # creating order with the above customer
-            order = models.Order.objects.create(customer=customer)
-
-            # getting cart items by cart_id
-            cart_items = models.CartItem.objects.select_related(
-                "product").filter(cart_id=cart_id)
+            # creating order with the above customer and its summary
+            order = models.Order.objects.create(
+                customer=customer,
+                total=sum([item.quantity * item.product.unit_price for item in cart_items]),
+                items_count=len(cart_items))
+            summaries.record_order(order)
 
             # creating order items to save in database
             order_items = [
@@ -221,11 +302,28 @@ class CreateOrderSerializer(serializers.Serializer):
             # deleting existing cart
             models.Cart.objects.filter(pk=cart_id).delete()
 
-            order_created.send_robust(self.__class__, order=order)
+            # the product lists show inventory and order counts
+            bump_versions(INVENTORY_VERSION)
+
+            # receivers run in the dispatch_outbox worker once this commits
+            outbox.publish("order_created", order_id=order.id)
 
             return order
 
 
+class DailySalesRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.DailySalesRollup
+        fields = ["day", "product_id", "collection_id", "units", "revenue"]
+
+
+class DailyCollectionSalesSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    collection_id = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Order
@@ -1,10 +1,53 @@
-from django.db.models.signals import post_save
+from django.db import connection
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
-from store.models import Customer
+from store.cache import COLLECTION_PRODUCTS_VERSION, bump_versions, forget_customer
+from store.models import Collection, Customer, Product, ProductImage, Promotion
+from store.search import invalidate_index
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs["created"]:
         Customer.objects.create(user=kwargs["instance"])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Promotion)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_versions(sender)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_collection_products_cache(sender, instance, created=False, **kwargs):
+    # the collection list counts products, other product changes leave it be
+    if (kwargs["signal"] is post_delete or created
+            or instance.collection_id != getattr(instance, "_loaded_collection_id", None)):
+        bump_versions(COLLECTION_PRODUCTS_VERSION)
+    instance._loaded_collection_id = instance.collection_id
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_search_index(sender, **kwargs):
+    invalidate_index()
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_product_promotions_cache(sender, **kwargs):
+    bump_versions(Product)
+
+
+@receiver(post_save, sender=Collection)
+def refresh_product_search_vectors(sender, instance, created, **kwargs):
+    # touching search_vector makes the trigger pick up the new collection title
+    if not created and connection.vendor == "postgresql":
+        Product.objects.filter(collection=instance).update(search_vector=None)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_customer_cache(sender, instance, **kwargs):
+    forget_customer(instance.user_id)
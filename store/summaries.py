@@ -0,0 +1,60 @@
+from django.db.models import Count, DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Customer, Order, OrderItem
+
+
+def order_total(order_id=OuterRef("pk")):
+    return OrderItem.objects.filter(order_id=order_id).order_by().values("order_id").annotate(
+        total=Sum(F("quantity") * F("unit_price"), output_field=DecimalField())).values("total")
+
+
+def order_items_count(order_id=OuterRef("pk")):
+    return OrderItem.objects.filter(order_id=order_id).order_by().values("order_id").annotate(
+        count=Count("id")).values("count")
+
+
+def customer_orders(field, aggregate, customer_id=OuterRef("pk")):
+    return Order.objects.filter(customer_id=customer_id).order_by().values("customer_id").annotate(
+        value=aggregate(field)).values("value")
+
+
+def record_order(order):
+    """
+    Adds a new order, whose total and items_count are set, to the summary of
+    its customer. Called by checkout in the order's transaction.
+    """
+    Customer.objects.filter(pk=order.customer_id).update(
+        orders_count=F("orders_count") + 1,
+        lifetime_spend=F("lifetime_spend") + order.total,
+        last_order_at=order.placed_at)
+
+
+def refresh_orders(orders):
+    orders.update(
+        total=Coalesce(Subquery(order_total()), Value(0), output_field=DecimalField()),
+        items_count=Coalesce(Subquery(order_items_count()), Value(0)))
+
+
+def refresh_customers(customers):
+    customers.update(
+        orders_count=Coalesce(Subquery(customer_orders("id", Count)), Value(0)),
+        lifetime_spend=Coalesce(Subquery(customer_orders("total", Sum)), Value(0),
+                                output_field=DecimalField()),
+        last_order_at=Subquery(customer_orders("placed_at", Max)))
+
+
+def refresh_order(order_id, *customer_ids):
+    """
+    Recomputes one order and the summaries of its customer, plus any former
+    customer given, after an edit outside checkout.
+    """
+    refresh_orders(Order.objects.filter(pk=order_id))
+    customer_ids = {customer_id for customer_id in customer_ids if customer_id is not None}
+    customer_ids |= set(Order.objects.filter(pk=order_id).values_list("customer_id", flat=True))
+    refresh_customers(Customer.objects.filter(pk__in=customer_ids))
+
+
+def rebuild():
+    refresh_orders(Order.objects.all())
+    refresh_customers(Customer.objects.all())
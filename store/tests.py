@@ -1 +1,1094 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from core.models import User
+from . import exports, outbox, urls
+from .cache import version_key
+from .models import Cart, CartItem, Collection, Customer, DailySalesRollup, Order, OrderItem, \
+    OutboxEvent, Product, ProductImage, Promotion, Review, CART_ITEM_MAX_QUANTITY
+from .provisioning import bulk_create_users
+from .rollups import refresh_rollups
+from .search import InvertedIndexSearchBackend
+from .serializers import CreateOrderSerializer
+from .signals import order_created
+from .views import ProductViewSet
+
+
 # Create your tests here.
+
+
+def create_user(username):
+    return User.objects.create_user(username=username, email=f"{username}@example.com", password="secret")
+
+
+def create_cart(*lines):
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product, quantity=quantity) for (product, quantity) in lines
+    ])
+    return cart
+
+
+class CatalogTestCase(TestCase):
+    """A Beverages collection of coffee, five in stock, and tea, one in stock."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = Collection.objects.create(title="Beverages")
+        cls.coffee = Product.objects.create(
+            title="Coffee", slug="coffee", unit_price=10, inventory=5, collection=cls.collection)
+        cls.tea = Product.objects.create(
+            title="Tea", slug="tea", unit_price=5, inventory=1, collection=cls.collection)
+
+
+class CheckoutInventoryTests(CatalogTestCase):
+    def setUp(self):
+        self.user = create_user("buyer")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_checkout_decrements_inventory(self):
+        cart = create_cart((self.coffee, 3), (self.tea, 1))
+
+        response = self.client.post("/store/orders/", {"cart_id": cart.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.coffee.refresh_from_db()
+        self.tea.refresh_from_db()
+        self.assertEqual(self.coffee.inventory, 2)
+        self.assertEqual(self.tea.inventory, 0)
+
+    def test_checkout_fails_cleanly_when_stock_is_short(self):
+        cart = create_cart((self.coffee, 3), (self.tea, 2))
+
+        response = self.client.post("/store/orders/", {"cart_id": cart.id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.tea.id), response.data["cart_id"][0])
+        self.coffee.refresh_from_db()
+        self.assertEqual(self.coffee.inventory, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_checkout_publishes_order_created_for_the_outbox(self):
+        receiver = mock.Mock()
+        order_created.connect(receiver)
+        self.addCleanup(order_created.disconnect, receiver)
+
+        response = self.client.post("/store/orders/", {"cart_id": create_cart((self.coffee, 1)).id})
+
+        self.assertEqual(list(OutboxEvent.objects.values_list("topic", "payload")),
+                         [("order_created", {"order_id": response.data["id"]})])
+        receiver.assert_not_called()
+        call_command("dispatch_outbox", "--once", stdout=StringIO())
+        self.assertEqual(receiver.call_args.kwargs["order"].pk, response.data["id"])
+
+    def test_cart_emptied_after_validation_is_not_ordered(self):
+        cart = create_cart((self.coffee, 1))
+        serializer = CreateOrderSerializer(data={"cart_id": cart.id}, context={"user_id": self.user.id})
+        self.assertTrue(serializer.is_valid())
+        cart.cartitem_set.all().delete()
+
+        with self.assertRaises(serializers.ValidationError):
+            serializer.save()
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderSummaryTests(CatalogTestCase):
+    def setUp(self):
+        self.staff = User.objects.create_superuser(
+            username="staff", email="staff@example.com", password="secret")
+        self.buyer = create_user("buyer")
+        self.client = APIClient()
+        self.client.force_login(self.staff)
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post("/store/orders/", {"cart_id": create_cart((self.coffee, 2), (self.tea, 1)).id})
+        self.order = Order.objects.get(pk=response.data["id"])
+
+    def assert_summaries(self, order, customer):
+        """order is (total, items_count), customer (orders_count, lifetime_spend, last_order_at)."""
+        self.assertEqual(tuple(Order.objects.values_list("total", "items_count").get(pk=self.order.pk)), order)
+        self.assertEqual(tuple(Customer.objects.values_list(
+            "orders_count", "lifetime_spend", "last_order_at").get(user=self.buyer)), customer)
+
+    def change_order(self, customer, quantities):
+        items = list(self.order.orderitem_set.order_by("id"))
+        data = {
+            "customer": customer.pk, "payment_status": Order.PAYMENT_STATUS_PENDING,
+            "orderitem_set-TOTAL_FORMS": len(items), "orderitem_set-INITIAL_FORMS": len(items),
+            "orderitem_set-MIN_NUM_FORMS": 1, "orderitem_set-MAX_NUM_FORMS": 10,
+        }
+        for (index, (item, quantity)) in enumerate(zip(items, quantities)):
+            data.update({f"orderitem_set-{index}-{field}": value for (field, value) in {
+                "id": item.pk, "order": self.order.pk, "product": item.product_id,
+                "quantity": quantity, "unit_price": item.unit_price}.items()})
+        response = self.client.post(f"/admin/store/order/{self.order.pk}/change/", data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_checkout_records_the_order(self):
+        self.assert_summaries((25, 2), (1, 25, self.order.placed_at))
+
+    def test_item_edit_in_the_admin_refreshes_the_order(self):
+        self.change_order(Customer.objects.get(user=self.buyer), [3, 1])
+
+        self.assert_summaries((35, 2), (1, 35, self.order.placed_at))
+
+    def test_order_moved_to_another_customer_leaves_the_first(self):
+        other = Customer.objects.get(user=create_user("other"))
+
+        self.change_order(other, [2, 1])
+
+        self.assert_summaries((25, 2), (0, 0, None))
+        other.refresh_from_db()
+        self.assertEqual((other.orders_count, other.lifetime_spend, other.last_order_at),
+                         (1, 25, self.order.placed_at))
+
+    def test_deleted_items_and_orders_leave_the_summaries(self):
+        for item in self.order.orderitem_set.all():
+            response = self.client.post(f"/admin/store/orderitem/{item.pk}/delete/", {"post": "yes"})
+            self.assertEqual(response.status_code, 302)
+        self.assert_summaries((0, 0), (1, 0, self.order.placed_at))
+
+        response = self.client.post(f"/admin/store/order/{self.order.pk}/delete/", {"post": "yes"})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(tuple(Customer.objects.values_list(
+            "orders_count", "lifetime_spend", "last_order_at").get(user=self.buyer)), (0, 0, None))
+
+    def test_rebuild_recomputes_every_summary(self):
+        Order.objects.update(total=0, items_count=0)
+        Customer.objects.update(orders_count=7, lifetime_spend=0, last_order_at=None)
+
+        call_command("rebuild_order_summaries", stdout=StringIO())
+
+        self.assert_summaries((25, 2), (1, 25, self.order.placed_at))
+
+
+class SalesRollupTests(CatalogTestCase):
+    monday = date(2026, 3, 2)
+    tuesday = date(2026, 3, 3)
+
+    def setUp(self):
+        self.customer = Customer.objects.get(user=create_user("buyer"))
+
+    def order(self, day, *lines):
+        order = Order.objects.create(customer=self.customer)
+        Order.objects.filter(pk=order.pk).update(placed_at=day)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, unit_price=product.unit_price)
+            for (product, quantity) in lines
+        ])
+        return order
+
+    def rollups(self):
+        return list(DailySalesRollup.objects.order_by("day", "product_id").values_list(
+            "day", "product_id", "collection_id", "units", "revenue"))
+
+    def test_days_are_rolled_up_per_product(self):
+        self.order(self.monday, (self.coffee, 2), (self.tea, 1))
+        self.order(self.monday, (self.coffee, 1))
+        self.order(self.tuesday, (self.tea, 3))
+
+        self.assertEqual(refresh_rollups(until=self.tuesday), [self.monday, self.tuesday])
+
+        self.assertEqual(self.rollups(), [
+            (self.monday, self.coffee.pk, self.collection.pk, 3, 30),
+            (self.monday, self.tea.pk, self.collection.pk, 1, 5),
+            (self.tuesday, self.tea.pk, self.collection.pk, 3, 15),
+        ])
+
+    def test_later_runs_add_only_new_days(self):
+        order = self.order(self.monday, (self.coffee, 1))
+        refresh_rollups(until=self.monday)
+        OrderItem.objects.filter(order=order).update(quantity=4)
+        self.order(self.tuesday, (self.coffee, 2))
+
+        self.assertEqual(refresh_rollups(until=self.tuesday), [self.tuesday])
+        self.assertEqual([row[3] for row in self.rollups()], [1, 2])
+        # recomputing the changed day
+        self.assertEqual(refresh_rollups(since=self.monday, until=self.tuesday), [self.monday, self.tuesday])
+        self.assertEqual([row[3] for row in self.rollups()], [4, 2])
+
+    def test_days_left_without_orders_lose_their_rows(self):
+        order = self.order(self.monday, (self.coffee, 1))
+        self.order(self.tuesday, (self.tea, 1))
+        refresh_rollups(until=self.tuesday)
+        order.orderitem_set.all().delete()
+        order.delete()
+
+        self.assertEqual(refresh_rollups(since=self.monday, until=self.tuesday), [self.tuesday])
+
+        self.assertEqual([row[:2] for row in self.rollups()], [(self.tuesday, self.tea.pk)])
+
+    def test_today_waits_until_it_is_complete(self):
+        self.order(timezone.localdate(), (self.coffee, 1))
+
+        call_command("refresh_sales_rollups", stdout=StringIO())
+
+        self.assertEqual(self.rollups(), [])
+
+
+class ExportTests(CatalogTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(
+            username="staff", email="staff@example.com", password="secret"))
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return (response, b"".join(response.streaming_content).decode())
+
+    def test_products_stream_as_csv(self):
+        (response, content) = self.export("/store/products/export/")
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="products.csv"')
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ["id", "title", "slug", "unit_price", "inventory", "collection_id", "last_update"])
+        self.assertEqual([row[:6] for row in rows[1:]], [
+            [str(self.coffee.pk), "Coffee", "coffee", "10.00", "5", str(self.collection.pk)],
+            [str(self.tea.pk), "Tea", "tea", "5.00", "1", str(self.collection.pk)],
+        ])
+
+    def test_products_stream_as_ndjson(self):
+        (response, content) = self.export("/store/products/export/?fmt=ndjson&unit_price__lt=7")
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="products.ndjson"')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row["slug"], row["unit_price"], row["inventory"]) for row in rows], [("tea", "5.00", 1)])
+
+    def test_order_lines_follow_the_order_filters(self):
+        customer = Customer.objects.get(user=create_user("buyer"))
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=order, product=self.coffee, quantity=2, unit_price=10)
+        paid = Order.objects.create(customer=customer, payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        OrderItem.objects.create(order=paid, product=self.tea, quantity=1, unit_price=5)
+
+        (response, content) = self.export("/store/orders/export/?fmt=ndjson&payment_status=P")
+
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="orders.ndjson"')
+        self.assertEqual([json.loads(line) for line in content.splitlines()], [{
+            "order_id": order.pk, "placed_at": str(order.placed_at), "payment_status": "P",
+            "customer_id": customer.pk, "product_id": self.coffee.pk, "quantity": 2, "unit_price": "10.00"}])
+
+    def test_only_staff_may_export(self):
+        self.client.force_authenticate(create_user("buyer"))
+
+        for path in ["/store/products/export/", "/store/orders/export/"]:
+            self.assertEqual(self.client.get(path).status_code, 403, path)
+
+    def test_blocks_hold_chunk_size_lines(self):
+        blocks = list(exports.export(exports.products_queryset(), exports.PRODUCT_COLUMNS, "csv", chunk_size=2))
+
+        self.assertEqual([block.count("\n") for block in blocks], [2, 1])
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.client.get("/store/products/export/?fmt=xml").status_code, 400)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    checkouts = 40
+    inventory = 15
+
+    def run_checkouts(self, checkouts):
+        """Saves a checkout per (user_id, cart_id) at once, returns their results."""
+        barrier = threading.Barrier(len(checkouts), timeout=30)
+        results = []
+
+        def checkout(user_id, cart_id):
+            try:
+                serializer = CreateOrderSerializer(data={"cart_id": cart_id}, context={"user_id": user_id})
+                serializer.is_valid(raise_exception=True)
+                barrier.wait()
+                serializer.save()
+                results.append("ok")
+            except serializers.ValidationError:
+                results.append("rejected")
+            except Exception as error:
+                results.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=args) for args in checkouts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([result for result in results if result not in ["ok", "rejected"]], [])
+        return results
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_concurrent_checkouts_never_oversell(self):
+        collection = Collection.objects.create(title="Flash sale")
+        hot = [
+            Product.objects.create(title=f"Hot {i}", slug=f"hot-{i}", unit_price=10,
+                                   inventory=self.inventory, collection=collection)
+            for i in range(2)
+        ]
+        # carts list the hot products in both orders so row locks taken in
+        # cart order would deadlock
+        checkouts = []
+        for i in range(self.checkouts):
+            lines = [(hot[0], 1), (hot[1], 1)] if i % 2 else [(hot[1], 1), (hot[0], 1)]
+            checkouts.append((create_user(f"buyer{i}").id, create_cart(*lines).id))
+
+        results = self.run_checkouts(checkouts)
+
+        self.assertEqual(results.count("ok"), self.inventory)
+        self.assertEqual(Order.objects.count(), self.inventory)
+        for product in hot:
+            product.refresh_from_db()
+            self.assertEqual(product.inventory, 0)
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_double_submitted_cart_is_ordered_once(self):
+        collection = Collection.objects.create(title="Beverages")
+        coffee = Product.objects.create(
+            title="Coffee", slug="coffee", unit_price=10, inventory=10, collection=collection)
+        user_id = create_user("buyer").id
+        cart_id = create_cart((coffee, 2)).id
+
+        results = self.run_checkouts([(user_id, cart_id)] * 4)
+
+        self.assertEqual(results.count("ok"), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        coffee.refresh_from_db()
+        self.assertEqual(coffee.inventory, 8)
+
+
+class AddCartItemTests(CatalogTestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.client = APIClient()
+
+    def add(self, product_id, quantity):
+        return self.client.post(f"/store/carts/{self.cart.pk}/items/",
+                                {"product_id": product_id, "quantity": quantity})
+
+    def assert_repeated_adds_add_up(self):
+        self.assertEqual(self.add(self.coffee.pk, 2).status_code, 201)
+        response = self.add(self.coffee.pk, 3)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["quantity"], 5)
+        self.assertEqual(list(self.cart.cartitem_set.values_list("product_id", "quantity")),
+                         [(self.coffee.pk, 5)])
+
+    def add_many(self, *lines):
+        return self.client.post(f"/store/carts/{self.cart.pk}/items/bulk/", {"items": [
+            {"product_id": product_id, "quantity": quantity} for (product_id, quantity) in lines
+        ]}, format="json")
+
+    def quantities(self):
+        return dict(self.cart.cartitem_set.values_list("product_id", "quantity"))
+
+    def assert_bulk_adds_add_up(self):
+        self.add(self.coffee.pk, 2)
+        response = self.add_many((self.coffee.pk, 1), (self.tea.pk, 1), (self.coffee.pk, 2))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {self.coffee.pk: 5, self.tea.pk: 1})
+
+    def test_repeated_adds_add_up(self):
+        self.assert_repeated_adds_add_up()
+
+    def test_bulk_adds_add_up(self):
+        self.assert_bulk_adds_add_up()
+
+    @skipUnless(connection.vendor == "sqlite", "only older SQLite versions go without the upsert")
+    def test_adds_add_up_without_upsert(self):
+        # SQLite before 3.35 has no RETURNING, add_product locks and updates
+        with mock.patch.object(connection.Database, "sqlite_version_info", (3, 34, 0)):
+            self.assert_repeated_adds_add_up()
+            self.cart.cartitem_set.all().delete()
+            self.assert_bulk_adds_add_up()
+
+    def test_quantities_stop_at_the_column_maximum(self):
+        self.add(self.coffee.pk, CART_ITEM_MAX_QUANTITY - 1)
+        self.add_many((self.coffee.pk, 5))
+
+        self.assertEqual(self.quantities(), {self.coffee.pk: CART_ITEM_MAX_QUANTITY})
+
+    def test_bulk_quantities_of_a_product_may_not_overflow(self):
+        response = self.add_many((self.coffee.pk, CART_ITEM_MAX_QUANTITY), (self.coffee.pk, 1))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), {})
+
+    def test_unknown_product_is_rejected(self):
+        response = self.add(self.tea.pk + 1, 1)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("product_id", response.data)
+        self.assertFalse(self.cart.cartitem_set.exists())
+
+
+class CursorPaginationTests(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        other = Collection.objects.create(title="Snacks")
+        # prices tie across pages
+        Product.objects.bulk_create([
+            Product(title=f"Product {i}", slug=f"product-{i}", unit_price=10 + i % 2, inventory=5,
+                    collection=cls.collection if i % 3 else other)
+            for i in range(30)
+        ])
+
+    def page_through(self, query):
+        client = APIClient()
+        (ids, url) = ([], f"/store/products/?pagination=cursor&{query}")
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotIn("count", response.data)
+            ids += [product["id"] for product in response.data["results"]]
+            url = response.data["next"]
+        return ids
+
+    def test_pages_follow_the_ordering(self):
+        ids = self.page_through("ordering=unit_price")
+
+        self.assertEqual(ids, list(Product.objects.order_by("unit_price", "-id").values_list("id", flat=True)))
+
+    def test_pages_of_a_filtered_list_have_every_row_once(self):
+        ids = self.page_through(f"collection_id={self.collection.pk}&unit_price__gt=5&ordering=-unit_price")
+
+        expected = Product.objects.filter(collection=self.collection, unit_price__gt=5)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids, list(expected.order_by("-unit_price", "-id").values_list("id", flat=True)))
+        self.assertGreater(len(ids), 10)
+
+
+class OutboxDispatchTests(TestCase):
+    def setUp(self):
+        self.handler = mock.Mock()
+        patcher = mock.patch.dict(outbox.HANDLERS, {"test": self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.event = outbox.publish("test", order_id=1)
+
+    def make_available(self):
+        OutboxEvent.objects.filter(pk=self.event.pk).update(available_at=timezone.now())
+
+    def test_delivered_event_is_not_delivered_again(self):
+        self.assertEqual(outbox.dispatch_pending(), (1, 0))
+        self.assertEqual(outbox.dispatch_pending(), (0, 0))
+
+        self.handler.assert_called_once_with({"order_id": 1})
+        self.event.refresh_from_db()
+        self.assertIsNotNone(self.event.dispatched_at)
+        self.assertEqual(self.event.attempts, 1)
+
+    def test_failed_event_is_retried_later(self):
+        self.handler.side_effect = [RuntimeError("down"), None]
+
+        self.assertEqual(outbox.dispatch_pending(), (0, 1))
+        self.event.refresh_from_db()
+        self.assertIn("RuntimeError: down", self.event.last_error)
+        self.assertGreater(self.event.available_at, timezone.now())
+        self.assertIsNone(self.event.dispatched_at)
+        # backing off
+        self.assertEqual(outbox.dispatch_pending(), (0, 0))
+
+        self.make_available()
+        self.assertEqual(outbox.dispatch_pending(), (1, 0))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attempts, 2)
+        self.assertEqual(self.event.last_error, "")
+        self.assertIsNotNone(self.event.dispatched_at)
+
+    def test_command_retries_failed_events(self):
+        self.handler.side_effect = [RuntimeError("down"), None]
+        output = StringIO()
+
+        call_command("dispatch_outbox", "--once", stdout=output)
+        self.make_available()
+        call_command("dispatch_outbox", "--once", stdout=output)
+
+        self.assertEqual(output.getvalue().splitlines(), ["dispatched 0, failed 1", "dispatched 1, failed 0"])
+        self.assertEqual(self.handler.call_count, 2)
+
+    def test_event_is_given_up_after_max_attempts(self):
+        self.handler.side_effect = RuntimeError("down")
+
+        for attempt in range(3):
+            self.make_available()
+            self.assertEqual(outbox.dispatch_pending(max_attempts=3), (0, 1))
+        self.make_available()
+        self.assertEqual(outbox.dispatch_pending(max_attempts=3), (0, 0))
+
+        self.assertEqual(self.handler.call_count, 3)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attempts, 3)
+        self.assertIsNone(self.event.dispatched_at)
+
+
+class CustomerCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user("buyer")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_me(self):
+        response = self.client.get("/store/customers/me/")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_customer_is_read_once(self):
+        self.get_me()
+
+        with self.assertNumQueries(0):
+            self.get_me()
+
+    def test_update_through_the_api_is_seen(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put("/store/customers/me/", {"phone": "555", "membership": "G"})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual((self.get_me()["phone"], self.get_me()["membership"]), ("555", "G"))
+
+    def test_update_elsewhere_is_seen(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            customer = Customer.objects.get(user=self.user)
+            customer.phone = "555"
+            customer.save()
+
+        self.assertEqual(self.get_me()["phone"], "555")
+
+
+class BulkCreateUsersTests(TestCase):
+    def rows(self, *usernames):
+        return [{"username": username, "email": f"{username}@example.com"} for username in usernames]
+
+    def test_users_get_one_customer_each(self):
+        rows = self.rows("ann", "bob", "cid")
+        rows[0]["membership"] = Customer.MEMBERSHIP_GOLD
+
+        self.assertEqual(bulk_create_users(rows, batch_size=2)["created"], 3)
+
+        self.assertEqual(sorted(Customer.objects.values_list("user__username", "membership")), [
+            ("ann", Customer.MEMBERSHIP_GOLD), ("bob", Customer.MEMBERSHIP_BRONZE),
+            ("cid", Customer.MEMBERSHIP_BRONZE)])
+        self.assertFalse(User.objects.get(username="ann").has_usable_password())
+
+    def test_usernames_repeated_in_the_rows_create_nobody(self):
+        for batch_size in [10, 1]:
+            with self.subTest(batch_size=batch_size), self.assertRaises(DjangoValidationError):
+                bulk_create_users(self.rows("ann", "bob", "ann"), batch_size=batch_size)
+
+        self.assertFalse(User.objects.exists())
+
+    def test_taken_usernames_and_emails_create_nobody(self):
+        create_user("bob")
+        rows = self.rows("ann", "bob")
+
+        with self.assertRaisesMessage(DjangoValidationError, "bob"):
+            bulk_create_users(rows)
+        rows[1]["username"] = "robert"
+        with self.assertRaisesMessage(DjangoValidationError, "bob@example.com"):
+            bulk_create_users(rows)
+
+        self.assertEqual(list(User.objects.values_list("username", flat=True)), ["bob"])
+
+    def test_usernames_are_validated(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(
+            username="staff", email="staff@example.com", password="secret"))
+
+        response = client.post("/store/customers/import/", self.rows("ann", "not valid!"), format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("username", response.data[1])
+        self.assertFalse(User.objects.filter(username="ann").exists())
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title="Beverages")
+
+    def import_products(self, text):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write(text)
+        self.addCleanup(os.remove, file.name)
+        call_command("import_products", file.name, stdout=StringIO())
+
+    def test_rows_create_and_update_products_by_slug(self):
+        self.import_products("title,slug,description,unit_price,inventory,collection\n"
+                             "Coffee,coffee,Dark roast,10,5,Beverages\n")
+        self.import_products("title,slug,description,unit_price,inventory,collection\n"
+                             "Coffee,coffee,Light roast,12,7,Beverages\n"
+                             "Tea,tea,,5,3,Beverages\n")
+
+        self.assertEqual(list(Product.objects.order_by("slug").values_list(
+            "slug", "description", "unit_price", "inventory")),
+            [("coffee", "Light roast", 12, 7), ("tea", None, 5, 3)])
+
+    def test_missing_fields_keep_their_value(self):
+        self.import_products("title,slug,description,unit_price,inventory,collection\n"
+                             "Coffee,coffee,Dark roast,10,5,Beverages\n")
+        self.import_products("title,slug,unit_price,inventory,collection\n"
+                             "Coffee,coffee,12,7,Beverages\n")
+
+        product = Product.objects.get(slug="coffee")
+        self.assertEqual(product.description, "Dark roast")
+        self.assertEqual(product.unit_price, 12)
+
+    def test_existing_products_need_no_inventory_or_collection(self):
+        self.import_products("title,slug,unit_price,inventory,collection\n"
+                             "Coffee,coffee,10,5,Beverages\n")
+        self.import_products("slug,unit_price,collection\n"
+                             "coffee,12,Beverages\n")
+        self.import_products("slug,inventory\n"
+                             "coffee,7\n")
+
+        self.assertEqual(list(Product.objects.values_list("title", "unit_price", "inventory", "collection__title")),
+                         [("Coffee", 12, 7, "Beverages")])
+
+    def test_new_products_need_every_field(self):
+        with self.assertRaisesMessage(CommandError, "tea"):
+            self.import_products("title,slug,unit_price,collection\n"
+                                 "Tea,tea,5,Beverages\n")
+        with self.assertRaisesMessage(CommandError, "tea"):
+            self.import_products("title,slug,unit_price,inventory\n"
+                                 "Tea,tea,5,3\n")
+
+        self.assertFalse(Product.objects.exists())
+
+    def test_malformed_collection_id_names_the_row(self):
+        with self.assertRaisesMessage(CommandError, "Invalid row 2: collection_id abc is not a number."):
+            self.import_products("title,slug,unit_price,inventory,collection_id\n"
+                                 f"Coffee,coffee,10,5,{self.collection.pk}\n"
+                                 "Tea,tea,5,3,abc\n")
+
+
+class ConditionalGetTests(CatalogTestCase):
+    def setUp(self):
+        cache.clear()
+        # a day old, so a change now moves Last-Modified by more than a second
+        yesterday = timezone.now() - timedelta(days=1)
+        Product.objects.update(last_update=yesterday)
+        cache.set_many({version_key(model): f"{yesterday.timestamp()}:old"
+                        for model in ProductViewSet.cache_models}, None)
+        self.client = APIClient()
+        self.last_modified = self.client.get("/store/products/")["Last-Modified"]
+
+    def get_if_modified(self):
+        return self.client.get("/store/products/", HTTP_IF_MODIFIED_SINCE=self.last_modified)
+
+    def test_unchanged_list_is_not_modified(self):
+        self.assertEqual(self.get_if_modified().status_code, 304)
+
+    def test_checkout_modifies_the_list(self):
+        with transaction.atomic():
+            Product.objects.decrement_inventory({self.coffee.pk: 1})
+
+        self.assertEqual(self.get_if_modified().status_code, 200)
+
+    def test_malformed_id_is_not_found(self):
+        self.assertEqual(self.client.get("/store/products/abc/").status_code, 404)
+        self.assertEqual(self.client.get(f"/store/products/{self.coffee.pk}/").status_code, 200)
+
+    def test_version_bump_modifies_the_list(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.coffee, image="store/images/coffee.jpg")
+
+        self.assertEqual(self.get_if_modified().status_code, 200)
+
+
+class CachedListInvalidationTests(CatalogTestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_superuser(
+            username="staff", email="staff@example.com", password="secret")
+        self.client = APIClient()
+        self.client.force_login(self.staff)
+        self.client.force_authenticate(self.staff)
+        # the queries of a cached response, the product list still checks
+        # If-Modified-Since
+        self.cached_queries = {}
+        for path in ["/store/products/", "/store/collections/"]:
+            self.client.get(path)
+            self.cached_queries[path] = self.count_queries(path)
+
+    def count_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return len(queries)
+
+    def assert_refetched(self, products, collections):
+        for (path, refetched) in [("/store/products/", products), ("/store/collections/", collections)]:
+            with self.subTest(path=path):
+                self.assertEqual(self.count_queries(path) > self.cached_queries[path], refetched)
+
+    def test_checkout_refreshes_only_the_products(self):
+        cart = create_cart((self.coffee, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post("/store/orders/", {"cart_id": cart.pk}).status_code, 200)
+
+        self.assert_refetched(products=True, collections=False)
+        products = self.client.get("/store/products/").data["results"]
+        self.assertEqual({product["slug"]: product["inventory"] for product in products}, {"coffee": 4, "tea": 1})
+
+    def test_product_change_refreshes_only_the_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coffee.unit_price = 11
+            self.coffee.save()
+
+        self.assert_refetched(products=True, collections=False)
+
+    def test_moved_product_refreshes_both(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.get(pk=self.coffee.pk)
+            product.collection = Collection.objects.create(title="Coffee")
+            product.save()
+
+        self.assert_refetched(products=True, collections=True)
+
+    def test_new_product_refreshes_both(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(title="Mate", slug="mate", unit_price=7, inventory=3,
+                                   collection=self.collection)
+
+        self.assert_refetched(products=True, collections=True)
+
+    def test_image_refreshes_only_the_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.coffee, image="store/images/coffee.jpg")
+
+        self.assert_refetched(products=True, collections=False)
+
+    def test_promotion_refreshes_only_the_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coffee.promotions.add(Promotion.objects.create(description="Sale", discount=0.1))
+
+        self.assert_refetched(products=True, collections=False)
+
+    def test_clear_inventory_refreshes_only_the_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/admin/store/product/", {
+                "action": "clear_inventory", "_selected_action": [self.coffee.pk]})
+        self.assertEqual(response.status_code, 302)
+
+        self.assert_refetched(products=True, collections=False)
+
+
+class InvertedIndexSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title="Beverages")
+        self.coffee = Product.objects.create(
+            title="Coffee beans", slug="coffee", unit_price=10, inventory=5, collection=self.collection)
+        self.cocoa = Product.objects.create(
+            title="Cocoa", slug="cocoa", unit_price=5, inventory=5, collection=self.collection)
+        self.backend = InvertedIndexSearchBackend()
+
+    def search(self, *terms):
+        return set(self.backend.search(Product.objects.all(), terms).values_list("pk", flat=True))
+
+    def test_terms_match_prefixes_of_every_field(self):
+        self.assertEqual(self.search("co"), {self.coffee.pk, self.cocoa.pk})
+        self.assertEqual(self.search("co", "bean"), {self.coffee.pk})
+        self.assertEqual(self.search("beverage"), {self.coffee.pk, self.cocoa.pk})
+        self.assertEqual(self.search("tea"), set())
+
+    def test_checkout_keeps_the_index(self):
+        self.backend.get_index()
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            Product.objects.decrement_inventory({self.coffee.pk: 1})
+
+        with self.assertNumQueries(0):
+            self.backend.get_index()
+
+    def test_text_changes_rebuild_the_index(self):
+        self.backend.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.title = "Drinks"
+            self.collection.save()
+
+        self.assertEqual(self.search("drink"), {self.coffee.pk, self.cocoa.pk})
+
+
+QUERY_BUDGETS = json.loads((Path(__file__).resolve().parent / "query_budgets.json").read_text())
+# rows per related set in the larger dataset, raise it to look for N+1 queries
+QUERY_BUDGET_DATASET_SIZE = int(os.environ.get("STORE_QUERY_BUDGET_DATASET_SIZE", 12))
+
+
+def route_names():
+    return sorted({pattern.name for router in [urls.router, urls.products_router, urls.carts_router]
+                   for pattern in router.urls})
+
+
+def async_route_names():
+    return sorted(pattern.name for pattern in urls.urlpatterns
+                  if getattr(pattern, "name", None) and pattern.name.startswith("async-"))
+
+
+class Dataset:
+    """
+    A catalog, customers, orders and a cart that grow together: every list
+    and every nested set (order lines, cart items, reviews, images) has the
+    same number of rows.
+    """
+
+    def __init__(self):
+        self.staff = User.objects.create_superuser(
+            username="staff", email="staff@example.com", password="secret")
+        self.customer = Customer.objects.get(user=self.staff)
+        collection = Collection.objects.create(title="Collection")
+        self.product = Product.objects.create(
+            title="Product", slug="product", unit_price=10, inventory=1000, collection=collection)
+        self.order = Order.objects.create(customer=self.customer)
+        self.cart = Cart.objects.create()
+        self.size = 0
+        self.imported = 0
+
+    def grow(self, size):
+        promotion = Promotion.objects.create(description="Sale", discount=0.1)
+        for i in range(self.size, size):
+            collection = Collection.objects.create(title=f"Collection {i}")
+            product = Product.objects.create(
+                title=f"Product {i}", slug=f"product-{i}", unit_price=10 + i, inventory=1000,
+                collection=collection)
+            product.promotions.add(promotion)
+            ProductImage.objects.create(product=self.product, image=f"store/images/{i}.jpg")
+            Review.objects.create(product=self.product, name=f"Reviewer {i}", description="Fine")
+
+            customer = Customer.objects.get(user=create_user(f"customer{i}"))
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.unit_price)
+            OrderItem.objects.create(order=self.order, product=product, quantity=2, unit_price=product.unit_price)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+            DailySalesRollup.objects.create(day=date.today() - timedelta(days=i), product=product,
+                                            collection=collection, units=1, revenue=product.unit_price)
+        self.size = size
+
+    def products(self):
+        return list(Product.objects.exclude(pk=self.product.pk).order_by("id")[:self.size])
+
+    def new_cart(self):
+        return create_cart(*[(product, 1) for product in self.products()])
+
+    def requests(self):
+        """(method, url kwargs, data) of the request exercising each route."""
+        self.imported += self.size
+        return {
+            "api-root": ("GET", {}, None),
+            "products-list": ("GET", {}, None),
+            "products-detail": ("GET", {"pk": self.product.pk}, None),
+            "products-export": ("GET", {}, None),
+            "collections-list": ("GET", {}, None),
+            "collections-detail": ("GET", {"pk": self.product.collection_id}, None),
+            "customers-list": ("GET", {}, None),
+            "customers-detail": ("GET", {"pk": self.customer.pk}, None),
+            "customers-me": ("GET", {}, None),
+            "customers-history": ("GET", {"pk": self.customer.pk}, None),
+            "customers-import-users": ("POST", {}, [
+                {"username": f"imported{i}", "email": f"imported{i}@example.com"}
+                for i in range(self.imported - self.size, self.imported)
+            ]),
+            "carts-list": ("GET", {}, None),
+            "carts-detail": ("GET", {"pk": self.cart.pk}, None),
+            "cart-items-list": ("GET", {"cart_pk": self.cart.pk}, None),
+            "cart-items-detail": ("GET", {"cart_pk": self.cart.pk,
+                                          "pk": self.cart.cartitem_set.order_by("id").first().pk}, None),
+            "cart-items-bulk": ("POST", {"cart_pk": Cart.objects.create().pk}, {"items": [
+                {"product_id": product.pk, "quantity": 1} for product in self.products()
+            ]}),
+            "orders-list": ("GET", {}, None),
+            "orders-detail": ("GET", {"pk": self.order.pk}, None),
+            "orders-summary": ("GET", {}, None),
+            "orders-export": ("GET", {}, None),
+            "reports-list": ("GET", {}, None),
+            "reports-collections": ("GET", {}, None),
+            "product-reviews-list": ("GET", {"product_pk": self.product.pk}, None),
+            "product-reviews-detail": ("GET", {"product_pk": self.product.pk,
+                                               "pk": self.product.review_set.order_by("id").first().pk}, None),
+            "product-images-list": ("GET", {"product_pk": self.product.pk}, None),
+            "product-images-detail": ("GET", {"product_pk": self.product.pk,
+                                              "pk": self.product.productimage_set.order_by("id").first().pk}, None),
+        }
+
+    def async_requests(self):
+        return {
+            "async-products-list": ("GET", {}, None),
+            "async-products-detail": ("GET", {"pk": self.product.pk}, None),
+            "async-product-reviews-list": ("GET", {"product_pk": self.product.pk}, None),
+            "async-collections-list": ("GET", {}, None),
+        }
+
+    def checkout(self):
+        return ("POST", {}, {"cart_id": self.new_cart().pk})
+
+
+class QueryBudgetMixin:
+    def assert_within_budgets(self, small, large):
+        for (key, count) in large.items():
+            (name, method) = key
+            with self.subTest(route=name, method=method):
+                self.assertEqual(count, small[key], f"{method} {name} runs more queries with more rows")
+                budget = QUERY_BUDGETS.get(name, {}).get(method)
+                self.assertIsNotNone(budget, f"{method} {name} has no budget in query_budgets.json")
+                self.assertLessEqual(count, budget, f"{method} {name} is over budget")
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Runs every store route against a small and a larger dataset. The query
+    count may not grow with the rows returned and may not exceed the budget
+    of the route in query_budgets.json.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.dataset = Dataset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.dataset.staff)
+
+    def count_queries(self, method, path, data=None):
+        # cached responses would hide the queries
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            if method == "GET":
+                response = self.client.get(path)
+            else:
+                response = self.client.post(path, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 300, f"{method} {path}: {response.status_code}")
+        return len(queries)
+
+    def measure(self, size):
+        self.dataset.grow(size)
+        counts = {}
+        for (name, (method, kwargs, data)) in self.dataset.requests().items():
+            counts[(name, method)] = self.count_queries(method, reverse(name, kwargs=kwargs), data)
+        (method, kwargs, data) = self.dataset.checkout()
+        counts[("orders-list", method)] = self.count_queries(method, reverse("orders-list"), data)
+        return counts
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(sorted(set(route_names() + async_route_names()) - set(QUERY_BUDGETS)), [])
+
+    def test_routes_stay_within_budget(self):
+        small = self.measure(2)
+        large = self.measure(QUERY_BUDGET_DATASET_SIZE)
+        self.assertEqual(sorted(name for (name, method) in large), sorted(route_names() + ["orders-list"]))
+        self.assert_within_budgets(small, large)
+
+    def test_admin_changelists_stay_within_budget(self):
+        self.client.force_login(self.dataset.staff)
+        names = [f"admin:store_{model._meta.model_name}_changelist"
+                 for model in admin.site._registry if model._meta.app_label == "store"]
+
+        def measure(size):
+            self.dataset.grow(size)
+            return {(name, "GET"): self.count_queries("GET", reverse(name)) for name in names}
+
+        self.assert_within_budgets(measure(2), measure(QUERY_BUDGET_DATASET_SIZE))
+
+
+class AsyncViewTests(QueryBudgetMixin, TransactionTestCase):
+    """
+    The async catalog views answer as the viewsets do. They query on worker
+    threads, with connections of their own, so the data is committed and
+    the queries are counted by the request's metrics.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.dataset = Dataset()
+        self.dataset.grow(2)
+        self.client = APIClient()
+
+    def get(self, path):
+        cache.clear()
+        return self.client.get(path)
+
+    def assert_same_response(self, path):
+        expected = self.get(path)
+        response = self.get(path.replace("/store/", "/store/async/", 1))
+
+        self.assertEqual(response.status_code, expected.status_code, path)
+        # links point to the async views
+        self.assertEqual(response.content.decode().replace("/store/async/", "/store/"),
+                         expected.content.decode(), path)
+        return response
+
+    def test_product_list_filters_searches_orders_and_pages_as_the_viewset(self):
+        for query in ["", "?search=product 1", "?unit_price__gt=10&unit_price__lt=12",
+                      "?ordering=-unit_price", "?page=1", "?pagination=cursor"]:
+            with self.subTest(query=query):
+                self.assertEqual(self.assert_same_response(f"/store/products/{query}").status_code, 200)
+
+    def test_product_list_errors(self):
+        self.assertEqual(self.assert_same_response("/store/products/?unit_price__gt=abc").status_code, 400)
+        self.assertEqual(self.assert_same_response("/store/products/?page=999").status_code, 404)
+
+    def test_product_detail(self):
+        self.assertEqual(self.assert_same_response(f"/store/products/{self.dataset.product.pk}/").status_code, 200)
+        self.assertEqual(self.assert_same_response("/store/products/0/").status_code, 404)
+
+    def test_review_list(self):
+        response = self.assert_same_response(f"/store/products/{self.dataset.product.pk}/reviews/")
+        self.assertEqual(len(response.json()), 2)
+
+    def test_collection_list(self):
+        response = self.assert_same_response("/store/collections/")
+        self.assertEqual(len(response.json()), 3)
+
+    def test_products_answer_conditional_requests(self):
+        for path in ["/store/async/products/", f"/store/async/products/{self.dataset.product.pk}/"]:
+            with self.subTest(path=path):
+                response = self.get(path)
+                self.assertIn("Last-Modified", response)
+
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+                self.assertEqual(self.client.get(
+                    path, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304)
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_only_reads_are_allowed(self):
+        self.assertEqual(self.client.post("/store/async/products/").status_code, 405)
+
+    def test_routes_stay_within_budget(self):
+        def measure(size):
+            self.dataset.grow(size)
+            counts = {}
+            for (name, (method, kwargs, data)) in self.dataset.async_requests().items():
+                response = self.get(reverse(name, kwargs=kwargs))
+                self.assertEqual(response.status_code, 200, name)
+                counts[(name, method)] = response.wsgi_request.metrics.queries
+            return counts
+
+        small = measure(2)
+        large = measure(QUERY_BUDGET_DATASET_SIZE)
+        self.assertEqual(sorted(name for (name, method) in large), async_route_names())
+        self.assert_within_budgets(small, large)
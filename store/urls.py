@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework_nested import routers
 
+from . import async_views
 from . import query_views
 # from . import mixins_views
 from . import views
@@ -11,6 +12,7 @@ router.register("collections", views.CollectionViewSet, basename="collections")
 router.register("customers", views.CustomerViewSet, basename="customers")
 router.register("carts", views.CartViewSet, basename="carts")
 router.register("orders", views.OrderViewSet, basename="orders")
+router.register("reports", views.ReportViewSet, basename="reports")
 
 products_router = routers.NestedSimpleRouter(
     router, "products", lookup="product")
@@ -31,6 +33,12 @@ urlpatterns = [
     path("", include(products_router.urls)),
     path("", include(carts_router.urls)),
 
+    path("async/products/", async_views.product_list, name="async-products-list"),
+    path("async/products/<int:pk>/", async_views.product_detail, name="async-products-detail"),
+    path("async/products/<int:product_pk>/reviews/", async_views.review_list,
+         name="async-product-reviews-list"),
+    path("async/collections/", async_views.collection_list, name="async-collections-list"),
+
     # path("collections/<int:pk>/", mixins_views.CollectionDetail.as_view(),
     #      name="collection-detail"),
     # path("customers/", mixins_views.CustomerList.as_view()),
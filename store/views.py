@@ -1,40 +1,63 @@
 from multiprocessing import context
-from django.db.models.aggregates import Count
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.db.models.aggregates import Count, Sum
+from django.db.models.functions import Coalesce
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.generics import get_object_or_404
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import ListModelMixin, CreateModelMixin, DestroyModelMixin, \
     RetrieveModelMixin
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
-from .filters import ProductFilter
-from .models import Cart, CartItem, Collection, Order, Product, OrderItem, ProductImage, Review
+from core.metrics import InstrumentedViewMixin
+from . import exports
+from .cache import COLLECTION_PRODUCTS_VERSION, INVENTORY_VERSION, CachedListMixin, ConditionalGetMixin, \
+    get_customer_for_user
+from .filters import DailySalesRollupFilter, OrderFilter, ProductFilter
+from .models import Cart, CartItem, Collection, DailySalesRollup, Order, Product, OrderItem, ProductImage, Promotion, Review
 from .models import Customer
-from .pagination import DefaultPagination
+from .pagination import CursorPaginationMixin, DefaultCursorPagination, DefaultPagination, ReviewCursorPagination
 from .permissions import IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, \
-    ProductSerializer, CollectionSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer, ProductImageSerializer
+from .provisioning import bulk_create_users
+from .search import ProductSearchFilter
+from .serializers import AddCartItemSerializer, BulkAddCartItemSerializer, CartItemSerializer, CartSerializer, CreateOrderSerializer, CustomerSerializer, CustomerSummarySerializer, \
+    DailyCollectionSalesSerializer, DailySalesRollupSerializer, OrderSerializer, \
+    ProductSerializer, CollectionSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer, ProductImageSerializer, UserImportSerializer
 
 
 # Create your views here.
 
 
-class CartViewSet(ListModelMixin,
+class CartViewSet(InstrumentedViewMixin, ListModelMixin,
                   CreateModelMixin,
                   DestroyModelMixin,
                   RetrieveModelMixin,
                   GenericViewSet):
-    queryset = Cart.objects.prefetch_related("cartitem_set__product").all()
+    # totals are summed by the database, one query for the carts and one for
+    # their items whatever the number of lines
+    queryset = Cart.objects.with_items().order_by("-created_at")
     serializer_class = CartSerializer
+    pagination_class = DefaultPagination
+
+    def get_permissions(self):
+        # carts are anonymous and reached through their id, only staff may
+        # walk all of them
+        if self.action == "list":
+            return [IsAdminUser()]
+        return super().get_permissions()
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(InstrumentedViewMixin, ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
 
     def get_serializer_class(self):
+        if self.action == "bulk":
+            return BulkAddCartItemSerializer
         if self.request.method == "POST":
             return AddCartItemSerializer
         elif self.request.method == "PATCH":
@@ -45,19 +68,37 @@ class CartItemViewSet(ModelViewSet):
         return {"cart_id": self.kwargs["cart_pk"]}
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related("product")
+        return CartItem.objects.with_total_price().filter(
+            cart_id=self.kwargs["cart_pk"]).select_related("product")
 
+    @action(detail=False, methods=["POST"])
+    def bulk(self, request, cart_pk):
+        cart = get_object_or_404(Cart.objects.only("id"), pk=cart_pk)
+        serializer = BulkAddCartItemSerializer(data=request.data, context={"cart_id": cart.id})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        serializer = CartSerializer(Cart.objects.with_items().get(pk=cart.id))
+        return Response(serializer.data)
 
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.select_related(
-        "collection").prefetch_related("orderitem_set").prefetch_related("productimage_set").all()
+
+class ProductViewSet(InstrumentedViewMixin, ConditionalGetMixin, CachedListMixin, CursorPaginationMixin, ModelViewSet):
+    # orders are counted by a correlated subquery, so only the rows of the
+    # current page are aggregated and no order items are loaded into memory;
+    # search_vector is only ever read inside the database
+    queryset = Product.objects.defer("search_vector").select_related(
+        "collection").prefetch_related("productimage_set").annotate(
+        orders_count=Coalesce(Subquery(
+            OrderItem.objects.filter(product_id=OuterRef("pk")).order_by()
+            .values("product_id").annotate(count=Count("id")).values("count")), 0))
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     pagination_class = DefaultPagination
+    cursor_pagination_class = DefaultCursorPagination
     search_fields = ["title", "description", "collection__title"]
     ordering_fields = ["id", "unit_price", "last_update"]
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = [Product, Collection, ProductImage, Promotion, INVENTORY_VERSION]
 
     """
     def get_queryset(self):
@@ -73,6 +114,15 @@ class ProductViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"request": self.request}
 
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        # ?fmt=, ?format= is DRF's renderer override
+        file_format = request.query_params.get("fmt", "csv")
+        if file_format not in exports.FORMATS:
+            return Response({"error": f"Unknown export format {file_format}."}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(exports.products_queryset())
+        return exports.streaming_response(queryset, exports.PRODUCT_COLUMNS, file_format, "products")
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs["pk"]).count() > 0:
             return Response({
@@ -83,10 +133,11 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(InstrumentedViewMixin, CachedListMixin, ModelViewSet):
     queryset = Collection.objects.annotate(products_count=Count("product"))
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = [Collection, COLLECTION_PRODUCTS_VERSION]
 
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(collection_id=kwargs["pk"]).count() > 0:
@@ -98,28 +149,39 @@ class CollectionViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(InstrumentedViewMixin, CursorPaginationMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    cursor_pagination_class = ReviewCursorPagination
 
     def get_queryset(self):
-        return Review.objects.filter(product_id=self.kwargs["product_pk"])
+        return Review.objects.filter(product_id=self.kwargs["product_pk"]).order_by("-date")
 
     def get_serializer_context(self):
         return {"product_id": self.kwargs["product_pk"]}
 
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(InstrumentedViewMixin, ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAdminUser]
 
+    @action(detail=False, methods=["POST"], url_path="import")
+    def import_users(self, request):
+        serializer = UserImportSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            result = bulk_create_users(serializer.validated_data)
+        except DjangoValidationError as error:
+            return Response({"error": error.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
+
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
         return Response("ok")
 
     @action(detail=False, methods=["GET", "PUT"], permission_classes=[IsAuthenticated])
     def me(self, request):
-        (customer, created) = Customer.objects.get_or_create(user_id=request.user)
+        customer = get_customer_for_user(request.user.id)
         if request.method == "GET":
             serializer = CustomerSerializer(customer)
             return Response(serializer.data)
@@ -140,30 +202,73 @@ class CustomerViewSet(ModelViewSet):
     """
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(InstrumentedViewMixin, CursorPaginationMixin, ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete", "head", "options"]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = DefaultPagination
+    # keyed on id: placed_at is a date shared by every order of the day, the
+    # id follows it (placed_at is auto_now_add) and is unique
+    cursor_pagination_class = DefaultCursorPagination
 
     def get_permissions(self):
-        if self.request.method in ["PATCH", "DELETE"]:
+        if self.request.method in ["PATCH", "DELETE"] or self.action == "export":
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
     def get_queryset(self):
         user = self.request.user
 
-        if user.is_staff:
-            return Order.objects.prefetch_related("orderitem_set").all()
+        # two queries for any number of orders and lines, loading only the
+        # product fields SimpleProductSerializer shows
+        queryset = Order.objects.prefetch_related(Prefetch(
+            "orderitem_set",
+            queryset=OrderItem.objects.select_related("product").only(
+                "id", "order_id", "quantity", "unit_price",
+                "product", "product__title", "product__unit_price")
+        )).order_by("-placed_at", "-id")
 
-        customer_id = Customer.objects.only(
-            "id").get(user_id=user.id)
-        return Order.objects.prefetch_related("orderitem_set").filter(customer_id=customer_id)
+        if user.is_staff:
+            return queryset
+
+        # CachedJWTAuthentication resolves the customer with the user
+        customer_id = getattr(user, "customer_id", None)
+        if customer_id is None:
+            customer_id = Customer.objects.values_list(
+                "id", flat=True).get(user_id=user.id)
+        return queryset.filter(customer_id=customer_id)
+
+    @action(detail=False)
+    def export(self, request):
+        # one row per order line, ?fmt= as for products
+        file_format = request.query_params.get("fmt", "csv")
+        if file_format not in exports.FORMATS:
+            return Response({"error": f"Unknown export format {file_format}."}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = exports.order_items_queryset().filter(
+            order__in=self.filter_queryset(Order.objects.all()).values("id"))
+        return exports.streaming_response(queryset, exports.ORDER_ITEM_COLUMNS, file_format, "orders")
+
+    @action(detail=False)
+    def summary(self, request):
+        # staff may look at any customer with ?customer_id=
+        customer_id = request.query_params.get("customer_id") if request.user.is_staff else None
+        if customer_id is None:
+            customer_id = getattr(request.user, "customer_id", None)
+        queryset = Customer.objects.only("id", "orders_count", "lifetime_spend", "last_order_at")
+        if customer_id is None:
+            customer = get_object_or_404(queryset, user_id=request.user.id)
+        else:
+            customer = get_object_or_404(queryset, pk=customer_id)
+        serializer = CustomerSummarySerializer(customer)
+        return Response(serializer.data)
 
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(data=request.data, context={
                                            "user_id": self.request.user.id})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
-        serializer = OrderSerializer(order)
+        # read back with the lines prefetched, not one product per line
+        serializer = OrderSerializer(self.get_queryset().get(pk=order.pk))
         return Response(serializer.data)
 
     def get_serializer_class(self):
@@ -174,7 +279,7 @@ class OrderViewSet(ModelViewSet):
         return OrderSerializer
 
 
-class ProductImageViewSet(ModelViewSet):
+class ProductImageViewSet(InstrumentedViewMixin, ModelViewSet):
     serializer_class = ProductImageSerializer
 
     def get_queryset(self):
@@ -182,3 +287,24 @@ class ProductImageViewSet(ModelViewSet):
 
     def get_serializer_context(self):
         return {"product_id": self.kwargs["product_pk"]}
+
+
+class ReportViewSet(InstrumentedViewMixin, ListModelMixin, GenericViewSet):
+    """
+    Daily sales read from the rollup table, never from the order tables.
+    """
+    queryset = DailySalesRollup.objects.order_by("-day", "product_id")
+    serializer_class = DailySalesRollupSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = DailySalesRollupFilter
+    pagination_class = DefaultPagination
+    permission_classes = [IsAdminUser]
+
+    @action(detail=False)
+    def collections(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            "day", "collection_id").annotate(units=Sum("units"), revenue=Sum("revenue")).order_by(
+            "-day", "collection_id")
+        page = self.paginate_queryset(queryset)
+        serializer = DailyCollectionSalesSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)